@@ -19,59 +19,339 @@ Sutthibutpong T, Harris S A and Noy A 2015 J. Chem. Theory Comput. 11 2768-75
 https://doi.org/10.1021/acs.jctc.5b00035
 """
 
-import sys
+import argparse
 import os
+import subprocess
 import writhe
-import caxislib
-
-print(__doc__)
-print("---\n")
-
-name = sys.argv[1]
-top = sys.argv[2]
-traj = sys.argv[3]
-num_bp = int(sys.argv[4])
-num_steps = int(sys.argv[5])
-try:
-    linear = sys.argv[6] not in ('0', 'False')
-except IndexError:
-    linear = False
-
-# Strip trajectory to get C1' coordinates
-os.system(f'mkdir -p {name}')
-os.system('\n'.join(['cpptraj <<EOF',
-                     f'parm {top}',
-                     f'trajin {traj}',
-                     "strip !(@C1') outprefix C1",
-                     f'trajout {name}/C.mdcrd',
-                     'EOF']))
-
-print(f"Processing {name}")
-print(f"Treating system as {'linear' if linear else 'circular'}")
-
-print("Reading files & initialising arrays")
-strand_a, strand_b, midpoints = caxislib.read(name, num_bp, num_steps,
-                                              linear=linear)
-
-print("Calculating first-order helical axis")
-helix_axis = caxislib.helix_axis(num_bp, num_steps, midpoints, strand_a,
-                                 linear=linear)
-
-print("Calculating twist")
-twist = caxislib.full_twist(name, num_bp, num_steps, strand_a, strand_b,
-                            helix_axis, linear=linear)
-
-print("Calculating helical axis")
-caxis = caxislib.caxis(name, num_bp, num_steps, midpoints, twist,
-                       linear=linear)
-
-print("Calculating register angles")
-sinreg = caxislib.sinreg(name, num_bp, num_steps, midpoints, caxis)
-
-print("Writing output .xyz and .3col files")
-caxislib.make_files(name, num_bp, num_steps, midpoints, caxis)
-
-print("Calculating writhe")
-wr = writhe.main(name, num_bp, num_steps, linear)
-
-print(f"Job {name} done!")
+import checkpoints
+import pipeline
+import trajectory
+
+
+def make_parser():
+    """
+    Returns the parser of the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Extract the helical axis and calculate writhe "
+                    "from an AMBER trajectory of DNA")
+    parser.add_argument('name', help="directory in which to store the output")
+    parser.add_argument('top', help="AMBER topology file")
+    parser.add_argument('traj', help="MD trajectory to be analysed")
+    parser.add_argument('num_bp', type=int, nargs='?', default=0,
+                        help="number of base pairs "
+                             "(0 or omitted: inferred from the input)")
+    parser.add_argument('num_steps', type=int, nargs='?', default=0,
+                        help="number of steps "
+                             "(0 or omitted: all frames in the trajectory)")
+    parser.add_argument('linear', nargs='?', default='0',
+                        help="1 if the system is open, "
+                             "0 (default) if it is closed into a loop")
+    parser.add_argument('--frame-start', type=int, default=0,
+                        help="first frame analysed, counting from 0 "
+                             "(default 0)")
+    parser.add_argument('--frame-stop', type=int,
+                        help="analyse frames before this one only "
+                             "(default: all frames)")
+    parser.add_argument('--frame-stride', type=int, default=1,
+                        help="analyse every n-th frame (default 1)")
+    parser.add_argument('--chunk-size', type=int,
+                        default=pipeline.CHUNK_SIZE,
+                        help="number of frames held in memory at once "
+                             f"(default {pipeline.CHUNK_SIZE})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes to analyse chunks "
+                             "in parallel (default 1)")
+    parser.add_argument('--output-format', default='text',
+                        choices=('text', 'binary', 'both'),
+                        help="write the legacy text files, .npy files, "
+                             "or both (default text)")
+    parser.add_argument('--precision', default='double',
+                        choices=list(pipeline.PRECISIONS),
+                        help="precision of the coordinates & intermediate "
+                             "results (default double)")
+    parser.add_argument('--pairing', metavar='SOURCE',
+                        help="pair the C1' atoms of each base pair "
+                             "from the chains of the topology ('topology') "
+                             "or as listed in a file of pairs of atom "
+                             "positions (default: strand A 5'-3', then "
+                             "strand B 5'-3', as written by CPPTRAJ)")
+    parser.add_argument('--register-angles', action='store_true',
+                        help="also write the signed register angles "
+                             "(degrees) to register.ser")
+    parser.add_argument('--writhe-density', action='store_true',
+                        help="also write the contribution of each base pair "
+                             "to writhe, and the local writhe about it, to "
+                             "writhe_density.ser & local_writhe.ser")
+    parser.add_argument('--local-window', type=int,
+                        default=writhe.LOCAL_WINDOW,
+                        help="number of base pairs in the window of local "
+                             f"writhe (default {writhe.LOCAL_WINDOW})")
+    parser.add_argument('--resume', action='store_true',
+                        help="checkpoint each stage in <name>/checkpoints "
+                             "and reuse the checkpoints of earlier runs")
+    parser.add_argument('--follow', action='store_true',
+                        help="analyse the trajectory while it is being "
+                             "written, stopping after num_steps frames")
+    parser.add_argument('--poll', type=float,
+                        default=pipeline.POLL_INTERVAL,
+                        help="seconds between checks for new frames with "
+                             f"--follow (default {pipeline.POLL_INTERVAL})")
+    parser.add_argument('--timeout', type=float, default=pipeline.TIMEOUT,
+                        help="stop --follow after this many seconds without "
+                             f"a new frame (default {pipeline.TIMEOUT})")
+    parser.add_argument('--writhe-method', default='gauss',
+                        choices=list(writhe.METHODS) + ['tree'],
+                        help="writhe calculation (default gauss)")
+    parser.add_argument('--writhe-stride', type=int, default=1,
+                        help="use every n-th point of the axis for writhe")
+    parser.add_argument('--theta', type=float, default=writhe.THETA,
+                        help="opening angle for --writhe-method tree "
+                             f"(default {writhe.THETA})")
+    parser.add_argument('--writhe-tolerance', type=float, default=0.0,
+                        help="adaptively decimate the axis for writhe, "
+                             "dropping points within this distance "
+                             "(Angstrom) of the axis kept (default 0: off)")
+    parser.add_argument('--writhe-incremental', type=float, default=0.0,
+                        help="reuse the writhe of each frame for the next, "
+                             "recalculating only pairs involving points that "
+                             "have moved further than this (Angstrom) "
+                             "(default 0: off)")
+    parser.add_argument('--writhe-refresh', type=int, default=writhe.REFRESH,
+                        help="frames between full recalculations with "
+                             "--writhe-incremental "
+                             f"(default {writhe.REFRESH})")
+    return parser
+
+
+def check_options(parser, args):
+    """
+    Checks the analysis options shared with batch.py,
+    exiting through parser.error if any is out of range
+    or they cannot be combined
+    """
+    if args.chunk_size < 1 or args.workers < 1:
+        parser.error("--chunk-size and --workers must be positive")
+    if args.writhe_stride < 1:
+        parser.error("--writhe-stride must be positive")
+    if args.writhe_tolerance < 0 or args.writhe_incremental < 0:
+        parser.error("--writhe-tolerance and --writhe-incremental "
+                     "must not be negative")
+    if args.writhe_refresh < 1:
+        parser.error("--writhe-refresh must be positive")
+    if not 0 <= args.theta < 1:
+        parser.error("--theta must be at least 0 and less than 1")
+    if args.writhe_density and (args.writhe_stride > 1 or
+                                args.writhe_tolerance or
+                                args.writhe_incremental):
+        parser.error("--writhe-density needs the full axis, so cannot be "
+                     "combined with --writhe-stride, --writhe-tolerance "
+                     "or --writhe-incremental")
+    if args.writhe_incremental and (args.writhe_tolerance or
+                                    args.writhe_method == 'tree'):
+        parser.error("--writhe-incremental cannot be combined with "
+                     "--writhe-tolerance or --writhe-method tree")
+
+
+def strip(name, top, traj, output=None):
+    """
+    Strips a trajectory to its C1' atoms with CPPTRAJ,
+    writing name/C.mdcrd
+    CPPTRAJ writes its output & errors to the open file output, if given
+    Returns whether CPPTRAJ succeeded
+    """
+    script = '\n'.join([f'parm {top}',
+                        f'trajin {traj}',
+                        "strip !(@C1') outprefix C1",
+                        f'trajout {name}/C.mdcrd',
+                        ''])
+    if output is not None:
+        # Anything already written must come before CPPTRAJ's output
+        output.flush()
+    try:
+        return subprocess.run(['cpptraj'], input=script, text=True,
+                              stdout=output,
+                              stderr=(None if output is None
+                                      else subprocess.STDOUT)).returncode == 0
+    except OSError as error:
+        print(f"Cannot run CPPTRAJ: {error}")
+        return False
+
+
+def main(argv=None):
+    """
+    Runs the analysis described by the command line arguments argv
+    (by default, sys.argv)
+    Returns the writhe series
+    """
+    print(__doc__)
+    print("---\n")
+
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    name = args.name
+    top = args.top
+    traj = args.traj
+    num_bp = args.num_bp
+    num_steps = args.num_steps
+    linear = args.linear not in ('0', 'False')
+    if args.frame_start < 0 or args.frame_stride < 1:
+        parser.error("--frame-start must not be negative, "
+                     "and --frame-stride must be positive")
+    if args.frame_stop is not None and args.frame_stop <= args.frame_start:
+        parser.error("--frame-stop must be after --frame-start")
+    if args.follow and args.output_format != 'text':
+        parser.error("--follow only writes text output")
+    check_options(parser, args)
+
+    os.makedirs(name, exist_ok=True)
+    num_atoms = None
+    if trajectory.trajectory_format(traj) == 'mdcrd' and not args.follow:
+        # Stripping is skipped if neither input has changed since last run
+        stripped = args.resume and os.path.exists(f'{name}/C.mdcrd')
+        key = checkpoints.fingerprint(top, traj) if stripped else None
+        if stripped and key is None:
+            # The inputs have since been moved or deleted
+            print(f"Cannot find {top} or {traj}; "
+                  f"reusing stripped trajectory {name}/C.mdcrd")
+        elif stripped and checkpoints.is_current(name, 'strip', key):
+            print(f"Reusing stripped trajectory {name}/C.mdcrd")
+        elif strip(name, top, traj) and args.resume:
+            checkpoints.mark(name, 'strip',
+                             checkpoints.fingerprint(top, traj))
+        source = None
+        atoms = None
+        if not num_bp:
+            # The stripped trajectory holds the C1' atoms of the topology,
+            # so no more than a frame of them need be scanned
+            try:
+                c1_atoms = len(trajectory.select_atoms(
+                    trajectory.read_prmtop(top)))
+            except (OSError, KeyError, ValueError):
+                c1_atoms = None
+            try:
+                num_bp = trajectory.count_atoms(f'{name}/C.mdcrd',
+                                                c1_atoms) // 2
+            except OSError as error:
+                parser.error(f"Cannot infer num_bp: {error}")
+            except ValueError as error:
+                if not c1_atoms:
+                    parser.error(f"Cannot infer num_bp: {error}")
+                # e.g. frames with only full lines & no box line have no
+                # visible end, so only the topology can tell
+                num_bp = c1_atoms // 2
+    else:
+        # Binary trajectories, and trajectories still being written,
+        # are read directly
+        print(f"Reading C1' atoms from {top}")
+        source = traj
+        topology = trajectory.read_prmtop(top)
+        atoms = trajectory.select_atoms(topology)
+        num_atoms = len(topology['ATOM_NAME'])
+        if not num_bp:
+            num_bp = len(atoms) // 2
+        if len(atoms) != 2*num_bp:
+            parser.error(f"{top} contains {len(atoms)} C1' atoms; "
+                         f"expected {2*num_bp}")
+        if not args.follow:
+            try:
+                if trajectory.count_atoms(traj) != num_atoms:
+                    parser.error(f"{traj} does not have the {num_atoms} "
+                                 f"atoms of {top}")
+            except (OSError, ValueError) as error:
+                parser.error(f"Cannot read {traj}: {error}")
+
+    # The pairing is found once, and applied to every frame
+    pairing = None
+    if args.pairing is not None:
+        pairs = top if args.pairing == 'topology' else args.pairing
+        try:
+            if args.pairing == 'topology':
+                pairing = trajectory.topology_pairing(
+                    trajectory.read_prmtop(top))
+            else:
+                pairing = trajectory.read_pairing(args.pairing, 2*num_bp)
+        except (OSError, KeyError, ValueError) as error:
+            parser.error(f"Cannot read base pairs from {pairs}: {error}")
+        if pairing.shape != (2, num_bp):
+            parser.error(f"{pairs} pairs {pairing.shape[1]} base pairs; "
+                         f"expected {num_bp}")
+
+    # Check the trajectory before any heavy computation
+    filename = f'{name}/C.mdcrd' if source is None else source
+    if not args.follow or (os.path.exists(filename) and
+                           os.path.getsize(filename)):
+        try:
+            available = trajectory.count_frames(filename,
+                                                num_atoms or 2*num_bp)
+        except (OSError, ValueError) as error:
+            parser.error(f"Cannot read {num_bp} base pairs from "
+                         f"{filename}: {error}")
+        if args.frame_stop is not None:
+            available = min(available, args.frame_stop)
+        available = pipeline.selected(available, args.frame_start,
+                                      args.frame_stride)
+        if not args.follow:
+            if not num_steps:
+                num_steps = available
+            if not available:
+                parser.error(f"{filename} contains no complete frames "
+                             f"from frame {args.frame_start}")
+            elif available < num_steps:
+                parser.error(f"{filename} contains {available} complete "
+                             f"frames to analyse; expected {num_steps}")
+
+    if (args.writhe_density and not linear and
+            4 * (args.local_window // 2) >= num_bp):
+        parser.error(f"--local-window {args.local_window} is too long "
+                     f"for a circle of {num_bp} base pairs")
+
+    print(f"Processing {name}")
+    print(f"Treating system as {'linear' if linear else 'circular'}")
+
+    writhe_options = {'method': args.writhe_method,
+                      'stride': args.writhe_stride,
+                      'theta': args.theta,
+                      'tolerance': args.writhe_tolerance,
+                      'incremental': args.writhe_incremental,
+                      'refresh': args.writhe_refresh}
+    if args.follow and not num_steps and args.frame_stop is not None:
+        num_steps = pipeline.selected(args.frame_stop, args.frame_start,
+                                      args.frame_stride)
+    if args.follow:
+        print(f"Following {traj} for up to "
+              f"{num_steps or 'any number of'} steps")
+        wr = pipeline.follow(name, num_bp, num_steps or float('inf'), traj,
+                             atoms, num_atoms, linear=linear,
+                             chunk_size=args.chunk_size, poll=args.poll,
+                             timeout=args.timeout,
+                             register=args.register_angles,
+                             density=args.writhe_density,
+                             local_window=args.local_window,
+                             dtype=pipeline.PRECISIONS[args.precision],
+                             pairing=pairing, first_frame=args.frame_start,
+                             frame_stride=args.frame_stride,
+                             **writhe_options)
+    else:
+        print(f"Analysing {num_steps} steps, {args.chunk_size} at a time, "
+              f"using {args.workers} "
+              f"worker{'s' if args.workers > 1 else ''}")
+        formats = (('text', 'binary') if args.output_format == 'both'
+                   else (args.output_format,))
+        wr = pipeline.run(name, num_bp, num_steps, linear=linear,
+                          chunk_size=args.chunk_size, workers=args.workers,
+                          traj=source, atoms=atoms, formats=formats,
+                          register=args.register_angles,
+                          density=args.writhe_density,
+                          local_window=args.local_window,
+                          resume=args.resume,
+                          dtype=pipeline.PRECISIONS[args.precision],
+                          pairing=pairing, first_frame=args.frame_start,
+                          frame_stride=args.frame_stride, **writhe_options)
+
+    print(f"Job {name} done!")
+    return wr
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#! /usr/bin/env python3
+
+"""
+Batch analysis of many trajectories with reWrLINE
+
+Each line of the manifest describes one job:
+    <path> <topology_filename> <trajectory_filename> [<is_linear>]
+Blank lines, and lines beginning with #, are ignored.
+
+Jobs are run in a pool of worker processes, largest trajectory first.
+Each topology is parsed only once, however many jobs share it.
+Trajectories are read directly where possible,
+falling back to stripping them with CPPTRAJ.
+Each job writes the usual output files (and its log) to its own path,
+and a table of statistics of the writhe & twist of every job
+is written to a summary file.
+
+Usage:
+    batch.py <manifest> [--workers N] [--summary <filename>]
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import time
+import pipeline
+import trajectory
+import writhe
+import WrLINE
+
+# Default file to which the summary table is written
+SUMMARY = 'summary.tsv'
+# Columns of the summary table
+COLUMNS = ('name', 'status', 'num_bp', 'frames', 'linear',
+           'writhe_mean', 'writhe_std', 'writhe_min', 'writhe_max',
+           'twist_mean', 'twist_std', 'wall')
+# Log of each job, written to its path
+LOG = 'log.txt'
+
+
+def read_manifest(filename):
+    """
+    Reads a manifest of jobs
+    Returns a list of (path, topology, trajectory, linear)
+    """
+    jobs = []
+    with open(filename, 'r') as file:
+        for number, line in enumerate(file, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) not in (3, 4):
+                raise ValueError(f"{filename}:{number}: expected <path> "
+                                 "<topology> <trajectory> [<is_linear>]")
+            if fields[0] in (job[0] for job in jobs):
+                raise ValueError(f"{filename}:{number}: {fields[0]} "
+                                 "is the path of an earlier job")
+            linear = len(fields) == 4 and fields[3] not in ('0', 'False')
+            jobs.append((fields[0], fields[1], fields[2], linear))
+    return jobs
+
+
+def read_topologies(jobs):
+    """
+    Parses each distinct topology used by the jobs once
+    Returns a dictionary of the indices of the C1' atoms of each
+    and its total number of atoms,
+    or the error raised if it could not be parsed
+    """
+    topologies = {}
+    for _, top, _, _ in jobs:
+        if top not in topologies:
+            try:
+                topology = trajectory.read_prmtop(top)
+                topologies[top] = (trajectory.select_atoms(topology),
+                                   len(topology['ATOM_NAME']))
+            except (OSError, KeyError, ValueError) as error:
+                topologies[top] = error
+    return topologies
+
+
+def analyse_job(options, job):
+    """
+    Analyses one job (path, topology, trajectory, linear, topology)
+    where the last is the entry of read_topologies for its topology,
+    logging to path/LOG
+    Returns a dictionary of the entries of the summary table
+    """
+    name, top, traj, linear, topology = job
+    started = time.monotonic()
+    row = {'name': name, 'linear': int(linear)}
+    os.makedirs(name, exist_ok=True)
+    with open(f'{name}/{LOG}', 'w') as log, contextlib.redirect_stdout(log):
+        # One failed job must not stop the rest of the batch
+        try:
+            if isinstance(topology, Exception):
+                raise topology
+            atoms, num_atoms = topology
+            num_bp = len(atoms) // 2
+            row['num_bp'] = num_bp
+            try:
+                num_steps = trajectory.count_frames(traj, num_atoms)
+            except ValueError:
+                # Not a format that can be read directly
+                if not WrLINE.strip(name, top, traj, output=log):
+                    raise
+                traj = atoms = num_atoms = None
+                num_steps = trajectory.count_frames(f'{name}/C.mdcrd',
+                                                    2*num_bp)
+            pipeline.run(name, num_bp, num_steps, linear, traj=traj,
+                         atoms=atoms, num_atoms=num_atoms, **options)
+            with open(f'{name}/{pipeline.REPORT}', 'r') as report:
+                row.update(json.load(report)['summary'])
+            row['status'] = 'ok'
+        except Exception as error:
+            print(f"{type(error).__name__}: {error}")
+            row['status'] = f"error ({type(error).__name__})"
+    row['wall'] = time.monotonic() - started
+    return row
+
+
+def write_summary(filename, rows):
+    """
+    Writes the summary table of each job as tab-separated values
+    """
+    with open(filename, 'w') as file:
+        file.write('\t'.join(COLUMNS) + '\n')
+        for row in rows:
+            values = [row.get(column, '') for column in COLUMNS]
+            file.write('\t'.join(f'{value:.4f}' if isinstance(value, float)
+                                 else str(value) for value in values) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyse many trajectories listed in a manifest")
+    parser.add_argument('manifest',
+                        help="file listing one job per line: <path> "
+                             "<topology> <trajectory> [<is_linear>]")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of jobs run in parallel (default 1)")
+    parser.add_argument('--summary', default=SUMMARY,
+                        help=f"summary table to write (default {SUMMARY})")
+    parser.add_argument('--chunk-size', type=int,
+                        default=pipeline.CHUNK_SIZE,
+                        help="number of frames held in memory at once "
+                             f"by each job (default {pipeline.CHUNK_SIZE})")
+    parser.add_argument('--precision', default='double',
+                        choices=list(pipeline.PRECISIONS),
+                        help="precision of the coordinates & intermediate "
+                             "results (default double)")
+    parser.add_argument('--writhe-density', action='store_true',
+                        help="also write the writhe density & local writhe "
+                             "of each job")
+    parser.add_argument('--local-window', type=int,
+                        default=writhe.LOCAL_WINDOW,
+                        help="number of base pairs in the window of local "
+                             f"writhe (default {writhe.LOCAL_WINDOW})")
+    parser.add_argument('--writhe-method', default='gauss',
+                        choices=list(writhe.METHODS) + ['tree'],
+                        help="writhe calculation (default gauss)")
+    parser.add_argument('--writhe-stride', type=int, default=1,
+                        help="use every n-th point of the axis for writhe")
+    parser.add_argument('--theta', type=float, default=writhe.THETA,
+                        help="opening angle for --writhe-method tree "
+                             f"(default {writhe.THETA})")
+    parser.add_argument('--writhe-tolerance', type=float, default=0.0,
+                        help="adaptively decimate the axis for writhe, "
+                             "dropping points within this distance "
+                             "(Angstrom) of the axis kept (default 0: off)")
+    parser.add_argument('--writhe-incremental', type=float, default=0.0,
+                        help="reuse the writhe of each frame for the next, "
+                             "recalculating only pairs involving points that "
+                             "have moved further than this (Angstrom) "
+                             "(default 0: off)")
+    parser.add_argument('--writhe-refresh', type=int, default=writhe.REFRESH,
+                        help="frames between full recalculations with "
+                             "--writhe-incremental "
+                             f"(default {writhe.REFRESH})")
+    args = parser.parse_args(argv)
+    WrLINE.check_options(parser, args)
+
+    try:
+        jobs = read_manifest(args.manifest)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    topologies = read_topologies(jobs)
+    # Start the largest trajectories first, so that the pool is not left
+    # waiting on one long job at the end
+    order = sorted(range(len(jobs)), reverse=True, key=lambda i:
+                   os.path.getsize(jobs[i][2])
+                   if os.path.exists(jobs[i][2]) else 0)
+    task = functools.partial(analyse_job, {
+        'chunk_size': args.chunk_size,
+        'dtype': pipeline.PRECISIONS[args.precision],
+        'density': args.writhe_density,
+        'local_window': args.local_window,
+        'method': args.writhe_method,
+        'stride': args.writhe_stride,
+        'theta': args.theta,
+        'tolerance': args.writhe_tolerance,
+        'incremental': args.writhe_incremental,
+        'refresh': args.writhe_refresh,
+    })
+    queue = [jobs[i] + (topologies[jobs[i][1]],) for i in order]
+    print(f"Running {len(jobs)} jobs using {args.workers} "
+          f"worker{'s' if args.workers > 1 else ''}")
+    rows = {}
+    with contextlib.ExitStack() as stack:
+        if args.workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(args.workers))
+            finished = pool.imap_unordered(task, queue)
+        else:
+            finished = map(task, queue)
+        for row in finished:
+            print(f"\t{row['name']}: {row['status']} "
+                  f"({row['wall']:.1f} s)")
+            rows[row['name']] = row
+    # The table follows the order of the manifest
+    write_summary(args.summary, [rows[job[0]] for job in jobs])
+    print(f"Summary written to {args.summary}")
+
+
+if __name__ == '__main__':
+    main()
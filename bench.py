@@ -0,0 +1,300 @@
+#! /usr/bin/env python3
+
+"""
+Benchmarks for reWrLINE
+
+Generates synthetic trajectories of double-helical DNA of any length,
+times each stage of the analysis of them end to end through WrLINE.py,
+and checks the accuracy of each writhe method on torus knots,
+whose writhe is known analytically.
+Results are printed and appended to bench_output.txt
+(one JSON record per line, labelled with the current commit)
+so that they can be compared across commits.
+
+Usage:
+    bench.py [--sizes N [N ...]] [--frames N] [--methods M [M ...]]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import writhe
+
+# Rise (Angstrom) & twist (radians) per base-pair step of B-DNA
+RISE = 3.38
+TWIST = 2 * np.pi / 10.5
+# Distance (Angstrom) of each C1' atom from the helical axis
+RADIUS = 5.9
+# Angle about the axis between the two C1' atoms of a base pair
+GROOVE = 2.19
+# Standard deviation (Angstrom) of the noise added to each atom
+NOISE = 0.3
+# Torus knots (p, q) used to check the accuracy of writhe
+KNOTS = ((2, 3), (2, 5), (3, 4), (1, 5))
+# Ratio of the minor to major radius of those knots
+KNOT_RATIO = 0.03
+# File to which results are appended
+OUTPUT = 'bench_output.txt'
+# Directory containing WrLINE.py
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Curves
+
+
+def torus_knot(num_points, p, q, ratio=KNOT_RATIO, radius=1.0):
+    """
+    Returns num_points points of shape (num_points, 3)
+    along a (p, q) torus knot, which winds p times around the axis
+    of a torus of major radius radius and minor radius ratio * radius
+    and q times through its hole
+    """
+    t = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    ring = radius * (1 + ratio * np.cos(q * t))
+    return np.column_stack((ring * np.cos(p * t), ring * np.sin(p * t),
+                            radius * ratio * np.sin(q * t)))
+
+
+def knot_writhe(p, q):
+    """
+    Returns the writhe of a (p, q) torus knot, as parametrised above,
+    in the limit of a thin torus
+    """
+    return -q * (p - 1)
+
+
+def supercoil(num_bp, turns, ratio, phase=0.0):
+    """
+    Returns the axis of a circle of num_bp base pairs
+    wound into a toroidal supercoil of the given number of turns,
+    of shape (num_bp, 3)
+    """
+    t = np.linspace(0, 2 * np.pi, num_bp, endpoint=False)
+    ring = 1 + ratio * np.cos(turns * t + phase)
+    curve = np.column_stack((ring * np.cos(t), ring * np.sin(t),
+                             ratio * np.sin(turns * t + phase)))
+    # Scale so that each step has (on average) the rise of B-DNA
+    steps = np.linalg.norm(np.roll(curve, -1, axis=0) - curve, axis=1)
+    return curve * RISE / np.mean(steps)
+
+
+def bent_rod(num_bp, bend):
+    """
+    Returns the axis of a linear molecule of num_bp base pairs
+    bent through the angle bend (radians) in a plane,
+    of shape (num_bp, 3)
+    """
+    s = np.arange(num_bp) * RISE
+    if not bend:
+        return np.column_stack((s, 0 * s, 0 * s))
+    radius = s[-1] / bend
+    return np.column_stack((radius * np.sin(s / radius),
+                            radius * (1 - np.cos(s / radius)), 0 * s))
+
+
+def double_helix(axis, linear=False):
+    """
+    Returns the C1' coordinates of a right-handed double helix
+    following an axis of shape (num_bp, 3),
+    in the order written by CPPTRAJ (strand A 5'-3', then strand B 5'-3'),
+    of shape (2 * num_bp, 3)
+    """
+    num_bp = len(axis)
+    if linear:
+        tangents = np.gradient(axis, axis=0)
+    else:
+        tangents = np.roll(axis, -1, axis=0) - np.roll(axis, 1, axis=0)
+    tangents /= np.linalg.norm(tangents, axis=1)[:, None]
+    # Transport a normal vector along the axis without rotating it
+    normals = np.empty_like(axis)
+    normal = np.cross(tangents[0], np.roll(tangents[0], 1))
+    for j, tangent in enumerate(tangents):
+        normal = normal - np.dot(normal, tangent) * tangent
+        normals[j] = normal = normal / np.linalg.norm(normal)
+    binormals = np.cross(tangents, normals)
+    angles = TWIST * np.arange(num_bp)
+
+    def strand(offset):
+        return axis + RADIUS * (np.cos(angles + offset)[:, None] * normals +
+                                np.sin(angles + offset)[:, None] * binormals)
+
+    return np.concatenate((strand(0), strand(GROOVE)[::-1]))
+
+
+def synthetic(num_bp, num_frames, linear=False, turns=3, seed=0):
+    """
+    Returns a synthetic trajectory of shape (num_frames, 2 * num_bp, 3)
+    of a circular supercoil of the given number of turns
+    (or, if linear, a bent rod) that flexes from frame to frame,
+    with random noise added to every atom
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(num_frames):
+        flex = 0.1 * np.sin(2 * np.pi * i / max(num_frames, 2))
+        if linear:
+            axis = bent_rod(num_bp, 1 + flex)
+        else:
+            axis = supercoil(num_bp, turns, 0.15 + 0.05 * flex, phase=flex)
+        frames.append(double_helix(axis, linear))
+    coords = np.array(frames)
+    return coords + rng.normal(0, NOISE, np.shape(coords))
+
+
+# Files
+
+
+def write_prmtop(filename, num_atoms):
+    """
+    Writes a minimal AMBER topology of num_atoms C1' atoms
+    """
+    with open(filename, 'w') as file:
+        file.write("%FLAG ATOM_NAME\n%FORMAT(20a4)\n")
+        for start in range(0, num_atoms, 20):
+            file.write("C1' " * min(20, num_atoms - start) + "\n")
+
+
+def write_dcd(filename, coords):
+    """
+    Writes a trajectory of shape (num_frames, num_atoms, 3) as a DCD file
+    """
+    def record(data):
+        return struct.pack('i', len(data)) + data + struct.pack('i', len(data))
+
+    num_frames, num_atoms, _ = np.shape(coords)
+    with open(filename, 'wb') as file:
+        file.write(record(b'CORD' + struct.pack('20i', num_frames,
+                                                *[0] * 19)))
+        file.write(record(struct.pack('i', 1) + b'reWrLINE benchmark'
+                          .ljust(80)))
+        file.write(record(struct.pack('i', num_atoms)))
+        for frame in coords.astype('f4'):
+            for i in range(3):
+                file.write(record(frame[:, i].tobytes()))
+
+
+# Benchmarks
+
+
+def end_to_end(num_bp, num_frames, linear, method, workers=1):
+    """
+    Analyses a synthetic trajectory with WrLINE.py
+    Returns the wall time taken and the report of each stage
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        write_prmtop(f'{directory}/C1.prmtop', 2 * num_bp)
+        write_dcd(f'{directory}/C1.dcd',
+                  synthetic(num_bp, num_frames, linear))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(HERE, 'WrLINE.py'),
+                        f'{directory}/out', f'{directory}/C1.prmtop',
+                        f'{directory}/C1.dcd', str(num_bp), str(num_frames),
+                        str(int(linear)), '--writhe-method', method,
+                        '--workers', str(workers)],
+                       check=True, stdout=subprocess.DEVNULL)
+        wall = time.perf_counter() - start
+        with open(f'{directory}/out/report.json', 'r') as file:
+            return wall, json.load(file)
+
+
+def accuracy(num_points, methods):
+    """
+    Calculates the writhe of each torus knot in KNOTS with each method
+    Returns a list of (p, q, method, writhe, analytic writhe, seconds)
+    """
+    results = []
+    for p, q in KNOTS:
+        curve = torus_knot(num_points, p, q)[None]
+        for method in methods:
+            start = time.perf_counter()
+            wr = writhe.calculate(curve, method=method)[0]
+            results.append((p, q, method, float(wr), knot_writhe(p, q),
+                            time.perf_counter() - start))
+    return results
+
+
+def commit():
+    """
+    Returns the current git commit, or None if it cannot be found
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark reWrLINE on synthetic trajectories")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[336, 1000, 3000],
+                        help="numbers of base pairs (default 336 1000 3000)")
+    parser.add_argument('--frames', type=int, default=10,
+                        help="number of frames (default 10)")
+    parser.add_argument('--methods', nargs='+', default=['gauss', 'tree'],
+                        choices=list(writhe.METHODS) + ['tree'],
+                        help="writhe methods (default gauss tree)")
+    parser.add_argument('--linear', action='store_true',
+                        help="also benchmark linear molecules")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (default 1)")
+    parser.add_argument('--knot-points', type=int, default=2000,
+                        help="points along each torus knot (default 2000)")
+    parser.add_argument('--output', default=os.path.join(HERE, OUTPUT),
+                        help=f"file to append results to (default {OUTPUT})")
+    args = parser.parse_args()
+
+    label = {'commit': commit(),
+             'date': datetime.datetime.now().isoformat(timespec='seconds')}
+    records = []
+
+    print(f"{'bp':>7} {'frames':>6} {'topology':>8} {'method':>6} "
+          f"{'wall/s':>8} {'frames/s':>9} {'slowest stage':>20}")
+    for linear in (False, True) if args.linear else (False,):
+        for num_bp in args.sizes:
+            for method in args.methods:
+                wall, report = end_to_end(num_bp, args.frames, linear,
+                                          method, args.workers)
+                stages = report['stages']
+                slowest = max(stages, key=lambda stage:
+                              stages[stage]['wall'])
+                print(f"{num_bp:7d} {args.frames:6d} "
+                      f"{'linear' if linear else 'circular':>8} "
+                      f"{method:>6} {wall:8.2f} {args.frames / wall:9.2f} "
+                      f"{slowest:>14} {stages[slowest]['wall']:5.2f}")
+                records.append(dict(label, benchmark='end_to_end',
+                                    num_bp=num_bp, frames=args.frames,
+                                    linear=linear, method=method,
+                                    workers=args.workers, wall=wall,
+                                    peak_rss=report['peak_rss'],
+                                    stages={stage: totals['wall']
+                                            for stage, totals
+                                            in stages.items()}))
+
+    print(f"\n{'knot':>6} {'method':>6} {'writhe':>9} {'analytic':>8} "
+          f"{'seconds':>8}")
+    for p, q, method, wr, analytic, seconds in accuracy(
+            args.knot_points, sorted(set(args.methods) | {'exact'})):
+        print(f"{f'({p},{q})':>6} {method:>6} {wr:9.4f} {analytic:8d} "
+              f"{seconds:8.3f}")
+        records.append(dict(label, benchmark='knot', p=p, q=q,
+                            points=args.knot_points, method=method,
+                            writhe=wr, analytic=analytic, wall=seconds))
+
+    with open(args.output, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
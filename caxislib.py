@@ -1,5 +1,14 @@
 import numpy as np
 
+# Layout of the fixed-width (10F8.3) .mdcrd format written by CPPTRAJ
+FIELD_WIDTH = 8
+FIELDS_PER_LINE = 10
+# Format of each value in tw.ser & sinreg.ser
+FORMAT = '%8.3f'
+# Approximate number of bytes of trajectory parsed at once
+# (parsing needs about twice this again, besides the output)
+CHUNK_BYTES = 2**22
+
 
 # Maths
 
@@ -20,14 +29,14 @@ def dot(a, b):
     Dot product of two arrays of vectors
     """
     assert(np.shape(a) == np.shape(b))
-    return sum(a[i] * b[i] for i in range(len(a)))
+    return np.sum(np.multiply(a, b), axis=0)
 
 
 def norm(a):
     """
     Norms of an array of vectors
     """
-    return np.sqrt(sum(x**2 for x in a))
+    return np.sqrt(np.sum(np.square(a), axis=0))
 
 
 def rotate_to_x(vector):
@@ -96,47 +105,335 @@ def twist(a1, a2, b1, b2, z):
     return np.arctan2(rotated_b[1], rotated_b[0]) * 180.0 / np.pi
 
 
+def batch_twist(a1, a2, b1, b2, z):
+    """
+    Returns the twist for arrays of vectors of shape (3, ...)
+    as for twist, but in a single pass:
+    both vectors are projected onto the plane normal to z
+    and the signed angle between them is found with arctan2
+    """
+    vector_a = a2 - a1
+    vector_b = b2 - b1
+    unit_z = z / norm(z)
+    # Components in the plane normal to z
+    plane_a = vector_a - dot(vector_a, unit_z) * unit_z
+    plane_b = vector_b - dot(vector_b, unit_z) * unit_z
+    return np.arctan2(dot(cross(plane_a, plane_b), unit_z),
+                      dot(plane_a, plane_b)) * 180.0 / np.pi
+
+
 # IO
 
 
-def read(name, num_bp, num_steps, linear=False):
+def line_lengths(num_fields):
+    """
+    Returns the lengths in bytes (including newlines) of the lines used to
+    store num_fields fixed-width fields
+    """
+    full, partial = divmod(num_fields, FIELDS_PER_LINE)
+    lengths = [FIELDS_PER_LINE * FIELD_WIDTH + 1] * full
+    if partial:
+        lengths.append(partial * FIELD_WIDTH + 1)
+    return lengths
+
+
+def frame_mask(num_atoms, box=False):
+    """
+    Returns the length in bytes of one frame of a .mdcrd file,
+    and a boolean mask over those bytes selecting the coordinate fields
+    (i.e. excluding newlines and any box line)
+    """
+    lengths = line_lengths(3 * num_atoms)
+    mask = np.concatenate([np.arange(n) < n - 1 for n in lengths])
+    if box:
+        mask = np.concatenate((mask, np.zeros(sum(line_lengths(3)), bool)))
+    return len(mask), mask
+
+
+def parse_fields(fields, dtype=np.float64):
+    """
+    Converts an array of shape (..., FIELD_WIDTH) of ASCII bytes
+    holding %8.3f fields to floating point
+    """
+    if np.all(fields[..., 4] == ord('.')):
+        # Fixed-point; accumulate the digits as an integer number of 1/1000s,
+        # a column at a time, so that no temporary is larger than a byte
+        # per field besides the integers themselves
+        value = np.zeros(np.shape(fields)[:-1], dtype=np.int32)
+        negative = np.zeros(np.shape(value), dtype=bool)
+        for i in (0, 1, 2, 3, 5, 6, 7):
+            column = fields[..., i]
+            negative |= column == ord('-')
+            # Bytes other than digits wrap around to above 9
+            digit = column - np.uint8(ord('0'))
+            digit[digit > 9] = 0
+            value *= 10
+            value += digit
+        np.negative(value, out=value, where=negative)
+        # The division is correctly rounded, exactly as float() would be
+        return (value / 1000.0).astype(dtype, copy=False)
+    # Anything else is left to the general parser
+    return (np.ascontiguousarray(fields).view(f'S{FIELD_WIDTH}')[..., 0]
+            .astype(dtype))
+
+
+def mdcrd_layout(filename, num_atoms):
+    """
+    Memory-maps a fixed-width .mdcrd file of num_atoms atoms per frame
+    Returns the mapped bytes, the offset of the first frame,
+    the length of each frame in bytes, and the mask selecting its fields
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    # Skip the title line
+    title = data[:FIELDS_PER_LINE * FIELD_WIDTH * 2]
+    header = int(np.argmax(title == ord('\n'))) + 1
+    frame_bytes, mask = frame_mask(num_atoms)
+    # An optional box line (three fields) follows each frame
+    box_bytes = sum(line_lengths(3))
+    next_line = header + frame_bytes + box_bytes - 1
+    if (next_line < len(data) and data[next_line] == ord('\n') and
+            not np.any(data[next_line - box_bytes + 1:next_line] ==
+                       ord('\n'))):
+        frame_bytes, mask = frame_mask(num_atoms, box=True)
+    return data, header, frame_bytes, mask
+
+
+def check_frames(layout, num_atoms, indices):
+    """
+    Raises ValueError unless the given frames of a .mdcrd file,
+    described by the layout returned by mdcrd_layout,
+    have exactly the line structure of a frame of num_atoms atoms
+    """
+    data, header, frame_bytes, _ = layout
+    lengths = line_lengths(3 * num_atoms)
+    if frame_bytes != sum(lengths):
+        lengths += line_lengths(3)
+    newlines = np.cumsum(lengths) - 1
+    for index in indices:
+        frame = data[header + index*frame_bytes:
+                     header + (index + 1)*frame_bytes]
+        if not np.array_equal(np.flatnonzero(frame == ord('\n')), newlines):
+            raise ValueError(f"Frame {index} is not laid out as a frame "
+                             f"of {num_atoms} atoms")
+
+
+def count_frames(filename, num_atoms):
+    """
+    Returns the number of complete frames of num_atoms atoms in a .mdcrd file,
+    having checked that the first & last are laid out as expected
+    """
+    layout = mdcrd_layout(filename, num_atoms)
+    data, header, frame_bytes, _ = layout
+    num_frames = (len(data) - header) // frame_bytes
+    check_frames(layout, num_atoms, {0, num_frames - 1} if num_frames else ())
+    return num_frames
+
+
+def infer_atoms(filename, max_atoms=None):
+    """
+    Infers the number of atoms per frame of a .mdcrd file of base pairs
+    (i.e. an even number of atoms) from the line lengths of its first frame
+    If max_atoms is given, no more than a frame of that many atoms
+    (and its box line) is scanned
+    Raises ValueError if the end of the first frame cannot be seen,
+    as when there is no box line and every line of a frame is full
+    """
+    data, header, _, _ = mdcrd_layout(filename, 1)
+    if header >= len(data):
+        raise ValueError(f"{filename} contains no frames")
+    full_line = FIELDS_PER_LINE * FIELD_WIDTH + 1
+    end = len(data)
+    if max_atoms is not None:
+        end = min(end, header + full_line *
+                  (len(line_lengths(3 * max_atoms)) + 1))
+    # Find the first line that is not full, scanning a block at a time
+    block = 2**20 // full_line * full_line
+    short = ()
+    for start in range(header, end, block):
+        ends = np.flatnonzero(data[start:min(start + block, end)] ==
+                              ord('\n'))
+        lengths = np.diff(np.concatenate(([-1], ends)))
+        short = np.flatnonzero(lengths != full_line)
+        if len(short) or len(ends) * full_line != block:
+            break
+    if not len(short):
+        raise ValueError(f"Cannot see where the first frame of {filename} "
+                         f"ends, so cannot infer its number of atoms")
+    lines = (start - header) // full_line + int(short[0])
+    fields = int(lengths[short[0]] - 1) // FIELD_WIDTH
+    # Three fields is a box line, as the last line of a frame of
+    # an even number of atoms has an even number of fields
+    num_fields = FIELDS_PER_LINE * lines + (0 if fields == 3 else fields)
+    num_atoms = num_fields // 3
+    if num_fields % 3 or num_atoms % 2 or not num_atoms:
+        raise ValueError(f"Cannot infer the number of atoms in {filename}")
+    count_frames(filename, num_atoms)
+    return num_atoms
+
+
+def parse_frames(layout, num_atoms, start, stop, dtype=np.float64, step=1):
+    """
+    Parses every step-th frame of frames [start, stop) of a .mdcrd file
+    described by the layout returned by mdcrd_layout
+    Only the bytes of those frames are read,
+    as each lies at a fixed offset from the first
+    Returns an array of shape (len(range(start, stop, step)), num_atoms, 3)
+    """
+    data, header, frame_bytes, mask = layout
+    count = len(range(start, stop, step))
+    if count and header + (start + (count - 1)*step + 1)*frame_bytes > \
+            len(data):
+        raise ValueError(f"Frame {start + (count - 1)*step} is beyond "
+                         "the end of the trajectory")
+    frames = np.lib.stride_tricks.as_strided(
+        data[header + start*frame_bytes:], shape=(count, frame_bytes),
+        strides=(step*frame_bytes, 1))
+    fields = np.reshape(frames[:, mask],
+                        (count, num_atoms, 3, FIELD_WIDTH))
+    return parse_fields(fields, dtype)
+
+
+def read_frames(filename, num_atoms, start, stop, dtype=np.float64, step=1):
+    """
+    Reads every step-th frame of frames [start, stop) of num_atoms atoms
+    from a .mdcrd file, seeking directly to each
+    Returns an array of shape (len(range(start, stop, step)), num_atoms, 3)
+    """
+    return parse_frames(mdcrd_layout(filename, num_atoms), num_atoms,
+                        start, stop, dtype, step)
+
+
+def iter_mdcrd(filename, num_atoms, num_steps, chunk_size=None,
+               dtype=np.float64):
+    """
+    Reads num_steps frames of num_atoms atoms from a fixed-width .mdcrd file
+    (or all of them, if num_steps is None)
+    in chunks of chunk_size frames
+    (by default, as many as fit in CHUNK_BYTES of the file)
+    Yields the index of the first frame of each chunk
+    and an array of shape (chunk_size, num_atoms, 3)
+    """
+    layout = mdcrd_layout(filename, num_atoms)
+    data, header, frame_bytes, _ = layout
+    available = (len(data) - header) // frame_bytes
+    if num_steps is None:
+        num_steps = available
+    if available < num_steps:
+        raise ValueError(f"{filename} contains {available} complete frames "
+                         f"of {num_atoms} atoms; expected {num_steps}")
+    # Fail now, rather than after parsing, if num_atoms is wrong
+    check_frames(layout, num_atoms, {0, num_steps - 1} if num_steps else ())
+    if chunk_size is None:
+        chunk_size = max(1, CHUNK_BYTES // frame_bytes)
+    for start in range(0, num_steps, chunk_size):
+        stop = min(num_steps, start + chunk_size)
+        yield start, parse_frames(layout, num_atoms, start, stop, dtype)
+
+
+def read_mdcrd(filename, num_atoms, num_steps=None, dtype=np.float64):
+    """
+    Reads num_steps frames of num_atoms atoms from a fixed-width .mdcrd file
+    (or all of them, if num_steps is None)
+    Returns an array of shape (num_steps, num_atoms, 3)
+    The file is memory-mapped & parsed in chunks of whole frames,
+    so only the output array need fit in memory
+    """
+    if num_steps is None:
+        num_steps = count_frames(filename, num_atoms)
+    result = np.empty((num_steps, num_atoms, 3), dtype=dtype)
+    for start, coords in iter_mdcrd(filename, num_atoms, num_steps,
+                                    dtype=dtype):
+        result[start:start + len(coords)] = coords
+    return result
+
+
+def default_pairing(num_bp):
+    """
+    Returns the pairing index of C1' atoms ordered as by CPPTRAJ
+    (strand A 5'-3', then strand B 5'-3'), of shape (2, num_bp):
+    row 0 indexes the atoms of strand A 5'-3',
+    and row 1 the atom of strand B paired with each
+    """
+    return np.array([np.arange(num_bp),
+                     np.arange(2*num_bp - 1, num_bp - 1, -1)])
+
+
+def check_pairing(pairing, num_atoms):
+    """
+    Checks that a pairing index (see default_pairing) pairs each of
+    num_atoms atoms exactly once
+    Returns the pairing index as an array of shape (2, num_atoms // 2)
+    """
+    pairing = np.asarray(pairing)
+    if pairing.shape != (2, num_atoms // 2) or num_atoms % 2:
+        raise ValueError(f"Expected {num_atoms // 2} pairs of atoms, "
+                         f"not an index of shape {pairing.shape}")
+    if np.any(pairing < 0):
+        raise ValueError("Pairing contains a negative index")
+    used = np.bincount(pairing.ravel(), minlength=num_atoms)
+    if len(used) > num_atoms or np.any(used != 1):
+        raise ValueError(f"Pairing must use each of the {num_atoms} atoms "
+                         "exactly once")
+    return pairing
+
+
+def strands(coords, num_bp, linear=False, pairing=None):
+    """
+    Splits an array of C1' coordinates of shape (num_steps, 2*num_bp, 3)
+    into the two strands & the midpoints of each base-pair step,
+    each of shape (3, num_steps, num_bp)
+    pairing indexes the atoms of each base pair (see default_pairing);
+    by default, atoms are ordered as by CPPTRAJ
+    """
+    if pairing is None:
+        pairing = default_pairing(num_bp)
+    # Both strands in a single gather, of shape (2, 3, num_steps, num_bp)
+    paired = np.ascontiguousarray(np.transpose(coords[:, pairing],
+                                               (1, 3, 0, 2)))
+    strand_a, strand_b = paired
+
+    # Coordinate representation of a base-pair step
+    following = np.roll(paired, -1, axis=3)
+    midpoints = 0.25 * (strand_a + following[0] + strand_b + following[1])
+    if linear:
+        midpoints[:, :, -1] = 0.5 * (strand_a[:, :, -1] + strand_b[:, :, -1])
+
+    return strand_a, strand_b, midpoints
+
+
+def read(name, num_bp=None, num_steps=None, linear=False, pairing=None):
     """
     Reads a .mdcrd file & create returns a 3D array of atomic coordinates
+    num_bp & num_steps are inferred from the file if None
+    pairing indexes the atoms of each base pair (see strands)
+    """
+    if num_bp is None:
+        num_bp = infer_atoms(name + '/C.mdcrd') // 2
+    coords = read_mdcrd(name + '/C.mdcrd', 2*num_bp, num_steps)
+    return strands(coords, num_bp, linear, pairing)
+
+
+def write_xyz(file, coords):
+    """
+    Writes frames of coordinates of shape (3, num_steps, num_bp)
+    to an open .xyz file
     """
-    with open(name + '/C.mdcrd', 'r') as file:
-        file.readline()
-        data = []
-        for line in file:
-            line_length = len(line)
-            num_fields = line_length // 8
-            for i in range(num_fields):
-                data.append(float(line[i*8:(i+1)*8]))
-
-        data_array = np.reshape(np.array(data), (len(data)//3, 3))
-
-        x = np.reshape(data_array[:, 0], (num_steps, num_bp*2))
-        y = np.reshape(data_array[:, 1], (num_steps, num_bp*2))
-        z = np.reshape(data_array[:, 2], (num_steps, num_bp*2))
-
-        strand_a = np.array([x[:, 0:num_bp], y[:, 0:num_bp], z[:, 0:num_bp]])
-        strand_b = np.array([x[:, (2*num_bp - 1):(num_bp - 1):-1],
-                             y[:, (2*num_bp - 1):(num_bp - 1):-1],
-                             z[:, (2*num_bp - 1):(num_bp - 1):-1]])
-
-        # Coordinate representation of a base-pair step
-        midpoints = np.zeros(np.shape(strand_a))
-        for i in range(num_bp):
-            if linear and i+1 >= np.shape(strand_a)[2]:
-                midpoints[:, :, i] = 0.5 * (strand_a[:, :, i] +
-                                            strand_b[:, :, i])
-            else:
-                midpoints[:, :, i] = (0.25 *
-                                      (strand_a[:, :, i] +
-                                       strand_a[:, :, ((i + 1) % num_bp)] +
-                                       strand_b[:, :, i] +
-                                       strand_b[:, :, ((i + 1) % num_bp)]))
-
-        return strand_a, strand_b, midpoints
+    num_bp = np.shape(coords)[2]
+    # Each frame is formatted with a single % operation
+    frame = f"{num_bp}\n\n" + "H %8.3f %8.3f %8.3f \n" * num_bp
+    for values in np.transpose(coords, (1, 2, 0)):
+        file.write(frame % tuple(values.ravel().tolist()))
+
+
+def write_3col(file, coords):
+    """
+    Writes frames of coordinates of shape (3, num_steps, num_bp)
+    to an open .3col file
+    """
+    num_bp = np.shape(coords)[2]
+    frame = "%8.3f %8.3f %8.3f \n" * num_bp
+    for values in np.transpose(coords, (1, 2, 0)):
+        file.write(frame % tuple(values.ravel().tolist()))
 
 
 def make_files(name, num_bp, num_steps, midpoints, caxis):
@@ -150,59 +447,49 @@ def make_files(name, num_bp, num_steps, midpoints, caxis):
             open(name + '/C1.xyz', 'w') as c1_xyz, \
             open(name + '/C.3col', 'w') as c_3col, \
             open(name + '/C1.3col', 'w') as c1_3col:
-        for i in range(num_steps):
-            c_xyz.write(f"{num_bp}\n\n")
-            c1_xyz.write(f"{num_bp}\n\n")
-            print(f"\r\tStep {i}...", end=" ")
-            for j in range(num_bp):
-                c_xyz.write(" ".join(["H",
-                                      f"{midpoints[0][i][j]:8.3f}",
-                                      f"{midpoints[1][i][j]:8.3f}",
-                                      f"{midpoints[2][i][j]:8.3f}",
-                                      "\n"]))
-                c1_xyz.write(" ".join(["H",
-                                       f"{caxis[0][i][j]:8.3f}",
-                                       f"{caxis[1][i][j]:8.3f}",
-                                       f"{caxis[2][i][j]:8.3f}",
-                                       "\n"]))
-                c_3col.write(" ".join([f"{midpoints[0][i][j]:8.3f}",
-                                       f"{midpoints[1][i][j]:8.3f}",
-                                       f"{midpoints[2][i][j]:8.3f}",
-                                       "\n"]))
-                c1_3col.write(" ".join([f"{caxis[0][i][j]:8.3f}",
-                                        f"{caxis[1][i][j]:8.3f}",
-                                        f"{caxis[2][i][j]:8.3f}",
-                                        "\n"]))
-        print("Done!")
-
-
-def sinreg(name, num_bp, num_steps, midpoints, caxis, write=True):
+        write_xyz(c_xyz, midpoints)
+        write_xyz(c1_xyz, caxis)
+        write_3col(c_3col, midpoints)
+        write_3col(c1_3col, caxis)
+
+
+def sinreg(name, num_bp, num_steps, midpoints, caxis, write=True,
+           first_step=0, angles=False):
     """
     Calculates sine of register angles
+        first_step is the index of the first frame,
+            used to label each row with its time in ns
+        angles gives the signed register angles themselves (in degrees),
+            written to register.ser rather than sinreg.ser
     """
+    j = np.arange(num_bp)
+    before = (j - 1) % num_bp
+    after = (j + 1) % num_bp
+    # Vectors bent on a plane
+    v0 = caxis - caxis[:, :, before]
+    v1 = caxis[:, :, after] - caxis
+    plane_vector = cross(v1, v0)
+    minor_groove = midpoints[:, :, before] - caxis[:, :, before]
+    # To obtain the sign of the result,
+    # where positive is a minor groove pointing into the circle,
+    # take the dot product of the minor groove with the unit normal vector
+    sign = np.where(dot(v1 - v0, minor_groove) < 0, -1.0, 1.0)
     result = np.zeros((num_steps, num_bp + 1))
-    for j in range(num_bp):
-        print(f"\r\tBase pair {j}...", end=" ")
-        m = list(map(int, np.linspace(j-1, j+1, num=3) % num_bp))
-        # Vectors bent on a plane
-        v0 = caxis[:, :, m[1]] - caxis[:, :, m[0]]
-        v1 = caxis[:, :, m[2]] - caxis[:, :, m[1]]
-        plane_vector = cross(v1, v0)
-        minor_groove = midpoints[:, :, m[0]] - caxis[:, :, m[0]]
+    if angles:
+        # The angle whose sine is sinreg and whose cosine is
+        # M <dot> C / (|M| |C|)
+        result[:, 1:] = np.degrees(np.arctan2(
+            sign * norm(cross(minor_groove, plane_vector)),
+            dot(minor_groove, plane_vector)))
+    else:
         # sinreg[:, j+1] = |M <cross> C| / (|M| |C|)
         # where M = minor_groove & C = plane_vector
-        result[:, j+1] = (norm(cross(minor_groove, plane_vector)) /
-                          (norm(minor_groove) * norm(plane_vector)))
-        # To obtain the sign of the result,
-        # where positive is a minor groove pointing into the circle,
-        # take the dot product of the minor groove with the unit normal vector
-        for i in range(num_steps):
-            if dot(v1 - v0, minor_groove)[i] < 0:
-                result[i, j+1] = -result[i, j+1]
-    result[:, 0] = np.linspace(0.01, 0.01*num_steps, num=num_steps)
+        result[:, 1:] = sign * (norm(cross(minor_groove, plane_vector)) /
+                                (norm(minor_groove) * norm(plane_vector)))
+    result[:, 0] = 0.01 * np.arange(first_step + 1, first_step + num_steps + 1)
     if write:
-        np.savetxt(name + '/sinreg.ser', result, fmt='%8.3f')
-    print("Done!")
+        np.savetxt(name + ('/register.ser' if angles else '/sinreg.ser'),
+                   result, fmt=FORMAT)
     return result
 
 
@@ -211,32 +498,25 @@ def helix_axis(num_bp, num_steps, midpoints, strand_a, linear=False):
     Calculates the first-order helical axis
     without taking the weight.
     Used for twist calculation.
+    The result has the precision of midpoints,
+    though the sums are accumulated in double precision
     """
-    result = np.zeros(np.shape(strand_a))
-    for j in range(num_bp):
-        print(f"\r\tBase pair {j}...", end=" ")
-        # Summation of coordinates
-        summation = np.zeros((3, num_steps))
-        for t in range(num_steps):
-            # Sum single helix position
-            summation[:, t] += midpoints[:, t, j]
-            k = 0
-            while k < 5:
-                k += 1
-                if linear:
-                    try:
-                        summation[:, t] += (midpoints[:, t, j-k] +
-                                            midpoints[:, t, j+k])
-                    except IndexError:
-                        k -= 1
-                        break
-                else:
-                    summation[:, t] += (midpoints[:, t, (j-k) % num_bp] +
-                                        midpoints[:, t, (j+k) % num_bp])
-            # Average helix (almost full turn)
-            result[:, t, j] = summation[:, t] / (2*k + 1)
-    print("Done!")
-    return result
+    j = np.arange(num_bp)
+    # Half-width of the window about each bp
+    # In linear DNA, only go as far as the 3' end
+    # (negative indices wrap, as they always have)
+    if linear:
+        width = np.minimum(5, num_bp - 1 - j)
+    else:
+        width = np.full(num_bp, 5)
+    # Sum single helix position
+    summation = np.array(midpoints, dtype=np.float64)
+    for k in range(1, 6):
+        inside = k <= width
+        summation[:, :, inside] += (midpoints[:, :, (j[inside] - k) % num_bp] +
+                                    midpoints[:, :, (j[inside] + k) % num_bp])
+    # Average helix (almost full turn)
+    return (summation / (2*width + 1)).astype(midpoints.dtype, copy=False)
 
 
 def full_twist(name, num_bp, num_steps, strand_a, strand_b, haxis,
@@ -244,39 +524,23 @@ def full_twist(name, num_bp, num_steps, strand_a, strand_b, haxis,
     """
     Calculates twist
     """
-    result = np.zeros((num_steps, num_bp))
-    for j in range(num_bp):
-        print(f"\r\tBase pair {j}...", end=" ")
-        for t in range(num_steps):
-            # Linear special cases
-            if linear:
-                # Does haxis[:, :, j+1] exist?
-                if np.shape(haxis)[2] > j + 1:
-                    # If haxis[:, :, j-1] doesn't exist,
-                    # approximate using half the range
-                    if j > 0:
-                        z = haxis[:, t, j+1] - haxis[:, t, j-1]
-                    else:
-                        z = 2 * (haxis[:, t, j+1] - haxis[:, t, j])
-                    result[t, j] = twist(strand_a[:, t, j],
-                                         strand_b[:, t, j],
-                                         strand_a[:, t, (j+1)],
-                                         strand_b[:, t, (j+1)],
-                                         z)
-                # If not, just return zero
-                # This may not be the best way to handle this
-                else:
-                    result[t, j] = 0
-            else:
-                z = haxis[:, t, (j+1) % num_bp] - haxis[:, t, (j-1) % num_bp]
-                result[t, j] = twist(strand_a[:, t, j],
-                                     strand_b[:, t, j],
-                                     strand_a[:, t, (j+1) % num_bp],
-                                     strand_b[:, t, (j+1) % num_bp],
-                                     z)
+    j = np.arange(num_bp)
+    following = (j + 1) % num_bp
+    z = haxis[:, :, following] - haxis[:, :, (j - 1) % num_bp]
+    # Linear special cases
+    if linear and num_bp > 1:
+        # If haxis[:, :, j-1] doesn't exist,
+        # approximate using half the range
+        z[:, :, 0] = 2 * (haxis[:, :, 1] - haxis[:, :, 0])
+    result = batch_twist(strand_a, strand_b,
+                         strand_a[:, :, following], strand_b[:, :, following],
+                         z)
+    if linear:
+        # haxis[:, :, j+1] doesn't exist for the last bp, so just return zero
+        # This may not be the best way to handle this
+        result[:, -1] = 0
     if write:
-        np.savetxt(name + '/tw.ser', result, fmt='%8.3f')
-    print("Done!")
+        np.savetxt(name + '/tw.ser', result, fmt=FORMAT)
     return result
 
 
@@ -285,43 +549,55 @@ def caxis(name, num_bp, num_steps, midpoints, tw, linear=False):
     Calculates the central helical axis
     by performing the running average of each bp with its 2*k neighbours
     & including the weight of the excess base pair
+    The result has the precision of midpoints,
+    though the running sums are accumulated in double precision
     """
-    result = np.zeros(np.shape(midpoints))
-    for j in range(num_bp):
-        print(f"\r\tBase pair {j}...", end=" ")
-        total_twist = np.zeros(num_steps)
-        summation = np.zeros((3, num_steps))
-        for t in range(num_steps):
-            total_twist[t] += tw[t, j]
-            summation[:, t] += midpoints[:, t, j]
-            k = 0
-            # Find the point where two more flanking steps would make twist
-            # exceed 360 degrees
-            while total_twist[t] < 360.0:
-                k += 1
-                prev = total_twist[t]
-                # In linear DNA, only go as far as the ends
-                # This might not be the best approach
-                if linear and (j-k < 0 or j+k >= num_bp):
-                    break
-                else:
-                    total_twist[t] += (tw[t, (j-k) % num_bp] +
-                                       tw[t, (j+k) % num_bp])
-                    # Sum single helix position
-                    summation[:, t] += (midpoints[:, t, (j-k) % num_bp] +
-                                        midpoints[:, t, (j+k) % num_bp])
-            # If the linear condition was met,
-            # the twist must be less than 360 degrees,
-            # so there's no need to remove the last two flanking steps
-            if linear and (j-k < 0 or j+k >= num_bp):
-                weight = 0
-            else:
-                # Add the flanks with weight < 1
-                weight = (360.0 - prev) / (total_twist[t] - prev)
-                summation[:, t] -= ((1 - weight) *
-                                    (midpoints[:, t, (j-k) % num_bp] +
-                                     midpoints[:, t, (j+k) % num_bp]))
-            weight_3d = np.array([weight, weight, weight])
-            result[:, t, j] = summation[:, t] / (2*(k + weight_3d) - 1)
-    print("Done!")
-    return result
+    j = np.arange(num_bp)
+    total_twist = np.array(tw, dtype=np.float64)
+    summation = np.array(midpoints, dtype=np.float64)
+    k = np.zeros(np.shape(tw), dtype=int)
+    prev = np.zeros(np.shape(tw))
+    at_end = np.zeros(np.shape(tw), dtype=bool)
+    # Find the point where two more flanking steps would make twist
+    # exceed 360 degrees, for every (t, j) at once
+    active = total_twist < 360.0
+    # Windows wider than the circle wrap around, which only terminates
+    # if the total twist of the circle is positive
+    stalled = (np.sum(tw, axis=1) <= 0)[:, None]
+    step = 0
+    while np.any(active):
+        step += 1
+        if step > num_bp and np.any(active & stalled):
+            raise ValueError("Twist never reaches 360 degrees; "
+                             "cannot determine the helical axis")
+        k[active] = step
+        prev[active] = total_twist[active]
+        # In linear DNA, only go as far as the ends
+        # This might not be the best approach
+        if linear:
+            ends = active & ((j - step < 0) | (j + step >= num_bp))
+            at_end |= ends
+            active &= ~ends
+        minus = (j - step) % num_bp
+        plus = (j + step) % num_bp
+        total_twist[active] += (tw[:, minus] + tw[:, plus])[active]
+        # Sum single helix position
+        summation[:, active] += (midpoints[:, :, minus] +
+                                 midpoints[:, :, plus])[:, active]
+        active &= total_twist < 360.0
+    # If the linear condition was met,
+    # the twist must be less than 360 degrees,
+    # so there's no need to remove the last two flanking steps;
+    # a lone step of 360 degrees or more is its own average
+    weight = np.zeros(np.shape(tw))
+    flanked = ~at_end & (k > 0)
+    weight[k == 0] = 1.0
+    weight[flanked] = ((360.0 - prev[flanked]) /
+                       (total_twist[flanked] - prev[flanked]))
+    # Add the flanks with weight < 1
+    t = np.arange(num_steps)[:, None]
+    flanks = (midpoints[:, t, (j - k) % num_bp] +
+              midpoints[:, t, (j + k) % num_bp])
+    summation[:, flanked] -= (1 - weight[flanked]) * flanks[:, flanked]
+    return (summation / (2*(k + weight) - 1)).astype(midpoints.dtype,
+                                                     copy=False)
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+
+# Subdirectory of the output directory in which checkpoints are kept
+DIRECTORY = 'checkpoints'
+
+
+def chunk_key(coords, num_bp, linear, start, pairing=None):
+    """
+    Returns a key identifying the analysis of a block of frames,
+    from a hash of their coordinates, the number of base pairs,
+    whether the system is linear, the index of the first frame,
+    and the pairing of their atoms, if not the default
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(coords).tobytes())
+    digest.update(repr((num_bp, bool(linear), start)).encode())
+    if pairing is not None:
+        digest.update(np.ascontiguousarray(pairing, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def options_key(options):
+    """
+    Returns a short key identifying a set of keyword options
+    """
+    return hashlib.sha1(repr(sorted(options.items())).encode()).hexdigest()[:8]
+
+
+def chunk_directory(name, key):
+    """
+    Returns the directory holding the checkpoints of one block of frames,
+    creating it if necessary
+    """
+    directory = os.path.join(name, DIRECTORY, key)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def load(directory, stage):
+    """
+    Returns the checkpointed result of a stage, or None if there is none
+    """
+    path = os.path.join(directory, stage + '.npy')
+    return np.load(path) if os.path.exists(path) else None
+
+
+def save(directory, stage, values):
+    """
+    Checkpoints the result of a stage
+    The file is written under a temporary name and then renamed,
+    so a job killed part way through never leaves a truncated checkpoint
+    """
+    path = os.path.join(directory, stage + '.npy')
+    with open(path + '.tmp', 'wb') as file:
+        np.save(file, values)
+    os.replace(path + '.tmp', path)
+
+
+def cached(directory, stage, compute):
+    """
+    Returns the checkpointed result of a stage if there is one;
+    otherwise calls compute and checkpoints its result
+    With directory None, simply returns compute()
+    """
+    if directory is None:
+        return compute()
+    values = load(directory, stage)
+    if values is None:
+        values = compute()
+        save(directory, stage, values)
+    return values
+
+
+def prune(name, keep):
+    """
+    Removes the checkpoints of every block of frames whose key is not in keep
+    """
+    directory = os.path.join(name, DIRECTORY)
+    if not os.path.isdir(directory):
+        return
+    for key in os.listdir(directory):
+        path = os.path.join(directory, key)
+        if key not in keep and os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def fingerprint(*paths):
+    """
+    Returns a key identifying the current contents of files
+    from their sizes and modification times,
+    or None if any of them cannot be found
+    """
+    try:
+        stats = [(path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+                 for path in paths]
+    except OSError:
+        return None
+    return hashlib.sha1(repr(stats).encode()).hexdigest()
+
+
+def is_current(name, step, key):
+    """
+    Returns whether a step was last completed with the given key
+    (never, if the key is None)
+    """
+    path = os.path.join(name, DIRECTORY, step + '.key')
+    if key is None or not os.path.exists(path):
+        return False
+    with open(path, 'r') as file:
+        return file.read().strip() == key
+
+
+def mark(name, step, key):
+    """
+    Records that a step has been completed with the given key
+    """
+    os.makedirs(os.path.join(name, DIRECTORY), exist_ok=True)
+    with open(os.path.join(name, DIRECTORY, step + '.key'), 'w') as file:
+        file.write(key + '\n')
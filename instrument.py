@@ -0,0 +1,119 @@
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory use is then not reported
+    resource = None
+
+# Minimum number of seconds between progress updates
+PROGRESS_INTERVAL = 1.0
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size over the whole run in bytes,
+    i.e. of this process or of any finished child process (such as
+    pool workers), or None if it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(who).ru_maxrss
+               for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # Reported in kilobytes, except on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def record(timings, stage, wall, cpu, frames, memory=0):
+    """
+    Adds one call of a stage, taking wall & cpu seconds to process frames
+    and allocating at most memory bytes more than it started with,
+    to a dictionary of timings
+    """
+    totals = timings.setdefault(stage, {'calls': 0, 'frames': 0,
+                                        'wall': 0.0, 'cpu': 0.0,
+                                        'peak_memory': 0})
+    totals['calls'] += 1
+    totals['frames'] += frames
+    totals['wall'] += wall
+    totals['cpu'] += cpu
+    totals['peak_memory'] = max(totals['peak_memory'], memory)
+
+
+@contextlib.contextmanager
+def timer(timings, stage, frames=0):
+    """
+    Records the wall & CPU time taken by the body of a with statement
+    as a call of stage processing frames, and the most memory it had
+    allocated at once beyond what was allocated when it started
+    (traced by tracemalloc, which is started if need be, so memory
+    mapped files and the interpreter itself are not counted)
+    Timers must not be nested, as each resets the traced peak
+    Does nothing if timings is None
+    """
+    if timings is not None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        allocated = tracemalloc.get_traced_memory()[0]
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            record(timings, stage, time.perf_counter() - wall,
+                   time.process_time() - cpu, frames,
+                   tracemalloc.get_traced_memory()[1] - allocated)
+
+
+def merge(timings, other):
+    """
+    Adds the timings of each stage in other
+    (e.g. those returned by another process) to timings
+    """
+    for stage, totals in other.items():
+        merged = timings.setdefault(stage, dict(totals, calls=0, frames=0,
+                                                wall=0.0, cpu=0.0))
+        for key in ('calls', 'frames', 'wall', 'cpu'):
+            merged[key] += totals[key]
+        merged['peak_memory'] = max(merged['peak_memory'],
+                                    totals['peak_memory'])
+
+
+def progress(done, total, started, last, interval=PROGRESS_INTERVAL):
+    """
+    Prints the number of frames analysed so far, and the rate,
+    unless it was last printed (at time last) under interval seconds ago
+    and there are still frames to analyse
+    Returns the time at which it was last printed
+    """
+    now = time.monotonic()
+    if now - last < interval and done < total:
+        return last
+    rate = done / max(now - started, 1e-9)
+    of_total = f"/{total}" if total != float('inf') else ""
+    print(f"\r\tStep {done}{of_total} ({rate:.1f} frames/s)...", end=" ")
+    return now
+
+
+def write_report(filename, timings, wall, **info):
+    """
+    Writes a JSON report of the timings of each stage,
+    the total wall time, the peak resident set size of the whole run
+    (see peak_rss), and any other information given
+    """
+    stages = {}
+    for stage, totals in timings.items():
+        stages[stage] = dict(totals, frames_per_second=(
+            totals['frames'] / totals['wall'] if totals['wall'] else None))
+    report = dict(info, wall=wall, cpu=sum(totals['cpu']
+                                           for totals in timings.values()),
+                  peak_rss=peak_rss(), stages=stages)
+    with open(filename, 'w') as file:
+        json.dump(report, file, indent=2)
+        file.write('\n')
@@ -0,0 +1,472 @@
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import time
+import numpy as np
+import caxislib
+import checkpoints
+import instrument
+import store
+import trajectory
+import writhe
+
+# Default number of frames analysed at once
+CHUNK_SIZE = 100
+# Default number of seconds between checks for new frames by follow
+POLL_INTERVAL = 1.0
+# Default number of seconds without a new frame after which follow stops
+TIMEOUT = 600.0
+
+# Text files written by run
+OUTPUTS = ('C.xyz', 'C1.xyz', 'C.3col', 'C1.3col',
+           'tw.ser', 'sinreg.ser', 'writhe.ser')
+# Written only if register angles are requested
+REGISTER = 'register.ser'
+# Written only if the axis is adaptively decimated for writhe
+WRITHE_ERROR = 'writhe_error.ser'
+# Written only if writhe density is requested
+DENSITY = 'writhe_density.ser'
+LOCAL_WRITHE = 'local_writhe.ser'
+# Report of the time & memory taken by each stage
+REPORT = 'report.json'
+# Floating-point types in which coordinates & intermediates may be held
+PRECISIONS = {'double': np.float64, 'single': np.float32}
+
+
+def process(strand_a, strand_b, midpoints, linear=False, first_step=0,
+            register=False, density=False, local_window=writhe.LOCAL_WINDOW,
+            checkpoint=None, timings=None, **writhe_options):
+    """
+    Runs every stage of the analysis on a block of frames
+        strand_a, strand_b & midpoints have shape (3, num_steps, num_bp)
+        first_step is the index of the first frame of the block
+        register also gives the signed register angles
+            (see caxislib.sinreg)
+        density also gives the contribution of each base pair to writhe,
+            from the same pass, and the local writhe within local_window
+            base pairs (see writhe.density & writhe.local_writhe)
+        checkpoint is a directory in which the result of each stage
+            is saved as it completes, and from which it is reloaded
+            rather than recalculated (see checkpoints)
+        timings is a dictionary to which the time taken by each stage
+            is added (see instrument)
+        writhe_options are passed to writhe.calculate;
+            with a tolerance, the estimated error in the writhe
+            of each frame is also given (see writhe.error_estimate)
+    Returns a dictionary of the results of each stage
+    """
+    num_steps, num_bp = np.shape(midpoints)[1:]
+
+    def stage(name, saved_as, compute):
+        with instrument.timer(timings, name, num_steps):
+            return checkpoints.cached(checkpoint, saved_as, compute)
+
+    haxis = stage('helix_axis', 'helix_axis', lambda:
+                  caxislib.helix_axis(num_bp, num_steps, midpoints, strand_a,
+                                      linear=linear))
+    twist = stage('full_twist', 'twist', lambda:
+                  caxislib.full_twist(None, num_bp, num_steps, strand_a,
+                                      strand_b, haxis, linear=linear,
+                                      write=False))
+    caxis = stage('caxis', 'caxis', lambda:
+                  caxislib.caxis(None, num_bp, num_steps, midpoints, twist,
+                                 linear=linear))
+    sinreg = stage('sinreg', 'sinreg', lambda:
+                   caxislib.sinreg(None, num_bp, num_steps, midpoints, caxis,
+                                   write=False, first_step=first_step))
+    # Writhe is calculated from the axis as written to C1.3col
+    axis = np.round(np.transpose(caxis, (1, 2, 0)), 3)
+    # Writhe is checkpointed separately for each set of options
+    options_key = checkpoints.options_key(writhe_options)
+    if density:
+        contributions = stage('writhe', 'writhe_density-' + options_key,
+                              lambda: writhe.density(axis, linear,
+                                                     **writhe_options))
+        wr = np.sum(contributions, axis=1)
+    else:
+        wr = stage('writhe', 'writhe-' + options_key,
+                   lambda: writhe.calculate(axis, linear, **writhe_options))
+    results = {
+        'helix_axis': haxis,
+        'twist': twist,
+        'caxis': caxis,
+        'sinreg': sinreg,
+        'writhe': writhe.series(wr, first_step),
+    }
+    if writhe_options.get('tolerance'):
+        error = stage('writhe_error', 'writhe_error-' + options_key, lambda:
+                      writhe.error_estimate(axis, wr, linear,
+                                            **writhe_options))
+        results['writhe_error'] = writhe.series(error, first_step)
+    if density:
+        results['writhe_density'] = writhe.series(contributions, first_step)
+        method = writhe_options.get('method', 'gauss')
+        local = stage('local_writhe',
+                      f'local_writhe-{method}-{local_window}', lambda:
+                      writhe.local_writhe(axis, linear, method, local_window))
+        results['local_writhe'] = writhe.series(local, first_step)
+    if register:
+        results['register'] = stage('register', 'register', lambda:
+                                    caxislib.sinreg(None, num_bp, num_steps,
+                                                    midpoints, caxis,
+                                                    write=False,
+                                                    first_step=first_step,
+                                                    angles=True))
+    return results
+
+
+def analyse(coords, linear=False, first_step=0, output=None,
+            register=False, density=False, local_window=writhe.LOCAL_WINDOW,
+            dtype=np.float64, pairing=None, **writhe_options):
+    """
+    Analyses an array of C1' coordinates of shape (num_steps, 2*num_bp, 3)
+    (or a single frame of shape (2*num_bp, 3)),
+    ordered as by CPPTRAJ (strand A 5'-3', then strand B 5'-3'),
+    entirely in memory
+        output is a directory to which the text output files
+            are also written, if not None
+        dtype is the floating-point type in which coordinates
+            & intermediates are held (see PRECISIONS)
+        pairing indexes the atoms of each base pair,
+            if they are not ordered as by CPPTRAJ
+            (see caxislib.default_pairing)
+        the other arguments are passed to process
+    Returns a dictionary of the midpoints of each base pair
+    and the results of each stage (see process)
+    """
+    coords = np.asarray(coords, dtype=dtype)
+    if coords.ndim == 2:
+        coords = coords[np.newaxis]
+    if coords.ndim != 3 or coords.shape[2] != 3 or coords.shape[1] % 2:
+        raise ValueError(f"Expected coordinates of shape "
+                         f"(num_steps, 2*num_bp, 3), not {coords.shape}")
+    num_bp = coords.shape[1] // 2
+    strand_a, strand_b, midpoints = caxislib.strands(coords, num_bp, linear,
+                                                     pairing)
+    results = process(strand_a, strand_b, midpoints, linear, first_step,
+                      register=register, density=density,
+                      local_window=local_window, **writhe_options)
+    results['midpoints'] = midpoints
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+        for filename, text in format_outputs(midpoints, results).items():
+            with open(os.path.join(output, filename), 'w') as file:
+                file.write(text)
+    return results
+
+
+def output_files(register=False, tolerance=0.0, density=False):
+    """
+    Returns the text files written, given whether register angles
+    are requested, the tolerance of adaptive decimation for writhe,
+    and whether writhe density is requested
+    """
+    return (OUTPUTS + ((REGISTER,) if register else ()) +
+            ((WRITHE_ERROR,) if tolerance else ()) +
+            ((DENSITY, LOCAL_WRITHE) if density else ()))
+
+
+def format_outputs(midpoints, results):
+    """
+    Formats the results of process for a block of frames
+    Returns a dictionary of the text to append to each output file
+    """
+    outputs = output_files('register' in results, 'writhe_error' in results,
+                           'writhe_density' in results)
+    text = {output: io.StringIO() for output in outputs}
+    caxislib.write_xyz(text['C.xyz'], midpoints)
+    caxislib.write_xyz(text['C1.xyz'], results['caxis'])
+    caxislib.write_3col(text['C.3col'], midpoints)
+    caxislib.write_3col(text['C1.3col'], results['caxis'])
+    np.savetxt(text['tw.ser'], results['twist'], fmt=caxislib.FORMAT)
+    np.savetxt(text['sinreg.ser'], results['sinreg'], fmt=caxislib.FORMAT)
+    np.savetxt(text['writhe.ser'], results['writhe'], fmt=writhe.FORMAT)
+    if 'register' in results:
+        np.savetxt(text[REGISTER], results['register'], fmt=caxislib.FORMAT)
+    if 'writhe_error' in results:
+        np.savetxt(text[WRITHE_ERROR], results['writhe_error'],
+                   fmt=writhe.FORMAT)
+    if 'writhe_density' in results:
+        row = writhe.density_format(np.shape(midpoints)[2])
+        np.savetxt(text[DENSITY], results['writhe_density'], fmt=row)
+        np.savetxt(text[LOCAL_WRITHE], results['local_writhe'], fmt=row)
+    return {output: buffer.getvalue() for output, buffer in text.items()}
+
+
+def analyse_chunk(filename, atoms, num_atoms, num_bp, linear, options,
+                  formats, name, bounds, dtype=np.float64, pairing=None,
+                  first_frame=0, frame_stride=1):
+    """
+    Reads & analyses frames [start, stop) = bounds of those selected
+    from a trajectory (every frame_stride-th frame from first_frame),
+    keeping only the given atom indices (see trajectory.read_frames)
+    num_atoms is the number of atoms per frame of a .mdcrd trajectory
+    Returns the checkpoint key of the frames (or None),
+    the writhe series & total twist of each frame (see summarise),
+    the formatted text output for those frames
+    if 'text' is in formats, the frames of each dataset to be stored
+    if 'binary' is in formats, and the timings of each stage
+    options are passed to process
+    Coordinates & intermediates are held as dtype
+    pairing indexes the atoms of each base pair (see caxislib.strands)
+    If name is not None, the results of each stage are checkpointed
+    in name/checkpoints, keyed by the frames' coordinates
+    Each call maps the file itself, so chunks can be farmed out to other
+    processes without pickling any coordinates
+    """
+    start, stop = bounds
+    timings = {}
+    with instrument.timer(timings, 'read', stop - start):
+        coords = trajectory.read_frames(filename, atoms,
+                                        first_frame + start*frame_stride,
+                                        first_frame + stop*frame_stride,
+                                        num_atoms=num_atoms, dtype=dtype,
+                                        step=frame_stride)
+        strand_a, strand_b, midpoints = caxislib.strands(coords, num_bp,
+                                                         linear, pairing)
+    key = None
+    checkpoint = None
+    if name is not None:
+        key = checkpoints.chunk_key(coords, num_bp, linear, start, pairing)
+        checkpoint = checkpoints.chunk_directory(name, key)
+    results = process(strand_a, strand_b, midpoints, linear, start,
+                      checkpoint=checkpoint, timings=timings, **options)
+    with instrument.timer(timings, 'make_files', stop - start):
+        text = (format_outputs(midpoints, results) if 'text' in formats
+                else None)
+        arrays = (store.frames(midpoints, results) if 'binary' in formats
+                  else None)
+    series = {'writhe': results['writhe'],
+              'twist': np.sum(results['twist'], axis=1)}
+    if 'writhe_error' in results:
+        series['writhe_error'] = results['writhe_error'][:, 1]
+    return key, series, text, arrays, timings
+
+
+def selected(available, first_frame=0, frame_stride=1):
+    """
+    Returns the number of frames selected from the first available frames
+    of a trajectory: every frame_stride-th frame from first_frame
+    """
+    return len(range(first_frame, available, frame_stride))
+
+
+def summarise(series):
+    """
+    Returns statistics of the writhe & total twist (in turns) of each frame,
+    and the largest estimated error in writhe if there is one,
+    given a list of the series of each chunk returned by analyse_chunk
+    """
+    if not series:
+        return {'frames': 0}
+    wr = np.concatenate([chunk['writhe'][:, 1] for chunk in series])
+    twist = np.concatenate([chunk['twist'] for chunk in series]) / 360
+    summary = {'frames': len(wr),
+               'writhe_mean': float(np.mean(wr)),
+               'writhe_std': float(np.std(wr)),
+               'writhe_min': float(np.min(wr)),
+               'writhe_max': float(np.max(wr)),
+               'twist_mean': float(np.mean(twist)),
+               'twist_std': float(np.std(twist))}
+    if 'writhe_error' in series[0]:
+        summary['writhe_error_max'] = float(max(
+            np.max(chunk['writhe_error']) for chunk in series))
+    return summary
+
+
+def run(name, num_bp, num_steps, linear=False, chunk_size=CHUNK_SIZE,
+        workers=1, traj=None, atoms=None, num_atoms=None, formats=('text',),
+        register=False, density=False, local_window=writhe.LOCAL_WINDOW,
+        resume=False, dtype=np.float64, pairing=None, first_frame=0,
+        frame_stride=1, **writhe_options):
+    """
+    Analyses name/C.mdcrd, chunk_size frames at a time,
+    appending the results of each chunk to the output files in name,
+    so that memory use does not grow with num_steps
+    With workers > 1, chunks are analysed in a pool of that many processes;
+    results are still written in order
+    Alternatively, a trajectory traj can be read directly,
+    in which case atoms gives the indices of the C1' atoms
+    (and, for .mdcrd, num_atoms the number of atoms per frame)
+    formats may include 'text' (the legacy output files)
+    and 'binary' (see store)
+    register also stores the signed register angles,
+    and density the writhe density & local writhe (see process)
+    With resume, the results of each stage of each chunk are checkpointed,
+    and those already checkpointed by an earlier run are reused,
+    so a job can be restarted, or extended to frames appended to
+    a trajectory, without repeating completed work
+    dtype is the floating-point type in which coordinates & intermediates
+    are held (see PRECISIONS); single precision halves the memory used
+    pairing indexes the atoms of each base pair,
+    if they are not ordered as by CPPTRAJ (see caxislib.default_pairing)
+    The num_steps frames analysed are every frame_stride-th frame
+    of the trajectory from first_frame, each read directly from its offset
+    in the file, so a strided preview reads proportionally less;
+    they are numbered consecutively in the output files, as by CPPTRAJ
+    The time & memory taken by each stage, and statistics of the results,
+    are reported in name/REPORT
+    Returns the writhe series
+    Raises ValueError, before any output is written,
+    unless num_steps is at least 1
+    """
+    started = time.monotonic()
+    if num_steps < 1:
+        raise ValueError(f"Expected at least one frame to analyse, "
+                         f"not {num_steps}")
+    filename = name + '/C.mdcrd' if traj is None else traj
+    if num_atoms is None:
+        num_atoms = 2*num_bp
+    available = selected(trajectory.count_frames(filename, num_atoms),
+                         first_frame, frame_stride)
+    if available < num_steps:
+        raise ValueError(f"{filename} contains {available} complete frames "
+                         f"of {num_atoms} atoms from frame {first_frame} "
+                         f"in steps of {frame_stride}; "
+                         f"expected {num_steps}")
+    chunks = [(start, min(num_steps, start + chunk_size))
+              for start in range(0, num_steps, chunk_size)]
+    options = dict(writhe_options, register=register, density=density,
+                   local_window=local_window)
+    task = functools.partial(analyse_chunk, filename, atoms, num_atoms,
+                             num_bp, linear, options, formats,
+                             name if resume else None, dtype=dtype,
+                             pairing=pairing, first_frame=first_frame,
+                             frame_stride=frame_stride)
+    series = []
+    keys = set()
+    timings = {}
+    last = started
+    with contextlib.ExitStack() as stack:
+        if 'text' in formats:
+            outputs = output_files(register, writhe_options.get('tolerance'),
+                                   density)
+            files = {output: stack.enter_context(open(f'{name}/{output}',
+                                                      'w'))
+                     for output in outputs}
+        if 'binary' in formats:
+            optional = tuple(dataset for dataset, wanted in (
+                ('register', register),
+                ('writhe_error', writhe_options.get('tolerance')),
+                ('writhe_density', density),
+                ('local_writhe', density)) if wanted)
+            datasets = store.create(name, num_bp, num_steps,
+                                    store.DATASETS + optional, linear=linear)
+        else:
+            store.discard_header(name)
+        if workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+            # imap preserves the order of the chunks
+            outputs = pool.imap(task, chunks)
+        else:
+            outputs = map(task, chunks)
+        for (start, stop), (key, chunk_series, text, arrays,
+                            chunk_timings) in zip(chunks, outputs):
+            instrument.merge(timings, chunk_timings)
+            with instrument.timer(timings, 'write', stop - start):
+                if text is not None:
+                    for output, chunk_text in text.items():
+                        files[output].write(chunk_text)
+                if arrays is not None:
+                    for dataset, values in arrays.items():
+                        datasets[dataset][start:stop] = values
+            series.append(chunk_series)
+            keys.add(key)
+            last = instrument.progress(stop, num_steps, started, last)
+        if 'binary' in formats:
+            for array in datasets.values():
+                array.flush()
+    if resume:
+        # Checkpoints of frames no longer in the trajectory
+        checkpoints.prune(name, keys)
+    print("Done!")
+    instrument.write_report(f'{name}/{REPORT}', timings,
+                            time.monotonic() - started, num_bp=num_bp,
+                            num_steps=num_steps, chunk_size=chunk_size,
+                            workers=workers, linear=linear,
+                            precision=np.dtype(dtype).name,
+                            first_frame=first_frame,
+                            frame_stride=frame_stride,
+                            summary=summarise(series), **writhe_options)
+    return np.concatenate([chunk['writhe'] for chunk in series])
+
+
+def follow(name, num_bp, num_steps, filename, atoms=None, num_atoms=None,
+           linear=False, chunk_size=CHUNK_SIZE, poll=POLL_INTERVAL,
+           timeout=TIMEOUT, register=False, density=False,
+           local_window=writhe.LOCAL_WINDOW, dtype=np.float64, pairing=None,
+           first_frame=0, frame_stride=1, **writhe_options):
+    """
+    Analyses a trajectory while it is still being written,
+    checking for newly completed frames every poll seconds
+    and appending the results for each to the text output files in name
+    as soon as it has been analysed
+    atoms are the indices of the C1' atoms (all atoms if None)
+    and num_atoms the number of atoms per frame of a .mdcrd trajectory
+    register, density, local_window, dtype, pairing, first_frame
+    & frame_stride are as for run
+    Stops once num_steps frames have been analysed,
+    or if no new frame has been written for timeout seconds
+    The time & memory taken by each stage, and statistics of the results,
+    are reported in name/REPORT
+    Returns the writhe series
+    """
+    started = time.monotonic()
+    options = dict(writhe_options, register=register, density=density,
+                   local_window=local_window)
+    task = functools.partial(analyse_chunk, filename, atoms, num_atoms,
+                             num_bp, linear, options, ('text',), None,
+                             dtype=dtype, pairing=pairing,
+                             first_frame=first_frame,
+                             frame_stride=frame_stride)
+    outputs = output_files(register, writhe_options.get('tolerance'),
+                           density)
+    done = 0
+    series = []
+    timings = {}
+    last = started
+    last_frame = started
+    with contextlib.ExitStack() as stack:
+        files = {output: stack.enter_context(open(f'{name}/{output}', 'w'))
+                 for output in outputs}
+        store.discard_header(name)
+        while done < num_steps:
+            # The file may not have been created yet
+            available = 0
+            if os.path.exists(filename) and os.path.getsize(filename) > 0:
+                available = min(num_steps, selected(
+                    trajectory.count_frames(filename, num_atoms),
+                    first_frame, frame_stride))
+            if available == done:
+                if time.monotonic() - last_frame > timeout:
+                    print(f"\n\tNo new frames for {timeout} s", end=" ")
+                    break
+                time.sleep(poll)
+                continue
+            for start in range(done, available, chunk_size):
+                stop = min(available, start + chunk_size)
+                result = task((start, stop))
+                _, chunk_series, text, _, chunk_timings = result
+                instrument.merge(timings, chunk_timings)
+                with instrument.timer(timings, 'write', stop - start):
+                    for output, chunk_text in text.items():
+                        files[output].write(chunk_text)
+                        files[output].flush()
+                series.append(chunk_series)
+                last = instrument.progress(stop, num_steps, started, last)
+            done = available
+            last_frame = time.monotonic()
+    print("Done!")
+    instrument.write_report(f'{name}/{REPORT}', timings,
+                            time.monotonic() - started, num_bp=num_bp,
+                            num_steps=done, chunk_size=chunk_size,
+                            workers=1, linear=linear,
+                            precision=np.dtype(dtype).name,
+                            first_frame=first_frame,
+                            frame_stride=frame_stride,
+                            summary=summarise(series), **writhe_options)
+    if not series:
+        return np.zeros((0, 2))
+    return np.concatenate([chunk['writhe'] for chunk in series])
@@ -0,0 +1,250 @@
+#! /usr/bin/env python3
+
+"""
+Binary storage of reWrLINE results
+
+Each dataset is stored in its own .npy file in the output directory,
+with one row per frame, so that results can be written a chunk at a time
+and read back without parsing any text.
+A small JSON header records the number of base pairs & frames,
+whether the system is linear, and the datasets stored;
+Results gives lazy access to any range of frames or base pairs,
+touching only the parts of each file that are used.
+
+Run as a script to write the legacy text files from binary results:
+    store.py <path>
+"""
+
+import json
+import os
+import sys
+import numpy as np
+import caxislib
+import writhe
+
+# Datasets stored, in the order they are written
+DATASETS = ('midpoints', 'caxis', 'twist', 'sinreg', 'writhe')
+# Stored only if requested
+OPTIONAL = ('register', 'writhe_error', 'writhe_density', 'local_writhe')
+# Datasets whose first column labels the frame, followed by one per base pair
+LABELLED = ('sinreg', 'register', 'writhe_density', 'local_writhe')
+# Datasets with no column per base pair
+SERIES = ('writhe', 'writhe_error')
+# File in the output directory describing the datasets stored
+HEADER = 'header.json'
+
+
+def frame_shapes(num_bp):
+    """
+    Returns the shape of one frame of each dataset
+    """
+    return {
+        'midpoints': (num_bp, 3),
+        'caxis': (num_bp, 3),
+        'twist': (num_bp,),
+        'sinreg': (num_bp + 1,),
+        'register': (num_bp + 1,),
+        'writhe': (2,),
+        'writhe_error': (2,),
+        'writhe_density': (num_bp + 1,),
+        'local_writhe': (num_bp + 1,),
+    }
+
+
+def filename(name, dataset):
+    """
+    Returns the path of the file storing a dataset
+    """
+    return f'{name}/{dataset}.npy'
+
+
+def write_header(name, num_bp, num_steps, linear, datasets):
+    """
+    Writes the header describing the datasets stored in name
+    """
+    header = {'num_bp': num_bp, 'num_steps': num_steps,
+              'linear': bool(linear), 'datasets': list(datasets)}
+    with open(f'{name}/{HEADER}', 'w') as file:
+        json.dump(header, file, indent=2)
+        file.write('\n')
+
+
+def read_header(name):
+    """
+    Returns the header describing the datasets stored in name
+    Results stored without a header are described from their files
+    """
+    if os.path.exists(f'{name}/{HEADER}'):
+        with open(f'{name}/{HEADER}', 'r') as file:
+            return json.load(file)
+    datasets = [dataset for dataset in DATASETS + OPTIONAL
+                if os.path.exists(filename(name, dataset))]
+    if 'twist' not in datasets:
+        raise ValueError(f"{name} contains no stored results")
+    num_steps, num_bp = np.shape(load(name, 'twist'))
+    return {'num_bp': num_bp, 'num_steps': num_steps, 'linear': None,
+            'datasets': datasets}
+
+
+def discard_header(name):
+    """
+    Removes the header of results stored in name by an earlier run,
+    which no longer describes the latest results
+    (the .npy files themselves are left in place)
+    """
+    if os.path.exists(f'{name}/{HEADER}'):
+        os.remove(f'{name}/{HEADER}')
+
+
+def create(name, num_bp, num_steps, datasets=DATASETS, dtype=np.float64,
+           linear=False):
+    """
+    Creates a .npy file for each dataset, large enough for num_steps frames,
+    and the header describing them
+    The files of any other datasets, left by an earlier run, are removed
+    Returns a dictionary of writable memory-mapped arrays
+    """
+    for dataset in DATASETS + OPTIONAL:
+        if (dataset not in datasets and
+                os.path.exists(filename(name, dataset))):
+            os.remove(filename(name, dataset))
+    write_header(name, num_bp, num_steps, linear, datasets)
+    shapes = frame_shapes(num_bp)
+    return {dataset: np.lib.format.open_memmap(filename(name, dataset),
+                                               mode='w+', dtype=dtype,
+                                               shape=(num_steps,) +
+                                               shapes[dataset])
+            for dataset in datasets}
+
+
+def load(name, dataset):
+    """
+    Memory-maps a stored dataset read-only
+    """
+    return np.load(filename(name, dataset), mmap_mode='r')
+
+
+class Results:
+    """
+    Lazy, read-only access to the results stored in a directory
+    Each dataset is memory-mapped when first used, and slicing it
+    reads only the frames & base pairs sliced, e.g.
+        results = store.Results(name)
+        results.axis(1000)                  # the axis of frame 1000
+        results['writhe'][::10, 1]          # the writhe of every 10th frame
+        results.select('twist', slice(100, 200), slice(10, 20))
+    """
+
+    def __init__(self, name):
+        header = read_header(name)
+        self.name = name
+        self.num_bp = header['num_bp']
+        self.num_steps = header['num_steps']
+        self.linear = header['linear']
+        self.datasets = tuple(header['datasets'])
+        self._arrays = {}
+
+    def __len__(self):
+        return self.num_steps
+
+    def __contains__(self, dataset):
+        return dataset in self.datasets
+
+    def __getitem__(self, dataset):
+        """
+        Returns the memory-mapped array of a dataset
+        """
+        if dataset not in self.datasets:
+            raise KeyError(f"{self.name} does not store {dataset}")
+        if dataset not in self._arrays:
+            self._arrays[dataset] = load(self.name, dataset)
+        return self._arrays[dataset]
+
+    def select(self, dataset, frames=slice(None), bps=slice(None)):
+        """
+        Returns a view of a dataset for the frame(s) & base pair(s) indexed
+        by frames & bps (integers or slices, or arrays of indices,
+        which give a copy instead), without the column labelling each frame
+        """
+        values = self[dataset][frames]
+        if dataset in SERIES:
+            if not (isinstance(bps, slice) and bps == slice(None)):
+                raise ValueError(f"{dataset} has no values per base pair")
+            return values
+        if dataset in LABELLED:
+            values = values[..., 1:]
+        if dataset in ('midpoints', 'caxis'):
+            return values[..., bps, :]
+        return values[..., bps]
+
+    def axis(self, frames=slice(None), bps=slice(None)):
+        """
+        Returns a view of the helical axis for the frame(s) & base pair(s)
+        indexed by frames & bps, of shape (..., num_bp, 3)
+        """
+        return self.select('caxis', frames, bps)
+
+
+def frames(midpoints, results):
+    """
+    Rearranges the results of pipeline.process for a block of frames
+    into the layout of each dataset
+    """
+    arrays = {
+        'midpoints': np.transpose(midpoints, (1, 2, 0)),
+        'caxis': np.transpose(results['caxis'], (1, 2, 0)),
+        'twist': results['twist'],
+        'sinreg': results['sinreg'],
+        'writhe': results['writhe'],
+    }
+    for dataset in OPTIONAL:
+        if dataset in results:
+            arrays[dataset] = results[dataset]
+    return arrays
+
+
+def export_text(name, chunk_size=1000):
+    """
+    Writes the legacy text output files from stored binary results,
+    chunk_size frames at a time
+    Only the datasets listed in the header are written
+    """
+    stored = read_header(name)['datasets']
+    arrays = {dataset: load(name, dataset) for dataset in DATASETS}
+    num_steps = len(arrays['writhe'])
+    with open(name + '/C.xyz', 'w') as c_xyz, \
+            open(name + '/C1.xyz', 'w') as c1_xyz, \
+            open(name + '/C.3col', 'w') as c_3col, \
+            open(name + '/C1.3col', 'w') as c1_3col, \
+            open(name + '/tw.ser', 'w') as tw, \
+            open(name + '/sinreg.ser', 'w') as sinreg, \
+            open(name + '/writhe.ser', 'w') as wr:
+        for start in range(0, num_steps, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            midpoints = np.transpose(arrays['midpoints'][chunk], (2, 0, 1))
+            caxis = np.transpose(arrays['caxis'][chunk], (2, 0, 1))
+            caxislib.write_xyz(c_xyz, midpoints)
+            caxislib.write_xyz(c1_xyz, caxis)
+            caxislib.write_3col(c_3col, midpoints)
+            caxislib.write_3col(c1_3col, caxis)
+            np.savetxt(tw, arrays['twist'][chunk], fmt=caxislib.FORMAT)
+            np.savetxt(sinreg, arrays['sinreg'][chunk], fmt=caxislib.FORMAT)
+            np.savetxt(wr, arrays['writhe'][chunk], fmt=writhe.FORMAT)
+    if 'register' in stored:
+        np.savetxt(name + '/register.ser', load(name, 'register'),
+                   fmt=caxislib.FORMAT)
+    if 'writhe_error' in stored:
+        np.savetxt(name + '/writhe_error.ser', load(name, 'writhe_error'),
+                   fmt=writhe.FORMAT)
+    for dataset in ('writhe_density', 'local_writhe'):
+        if dataset in stored:
+            values = load(name, dataset)
+            np.savetxt(f'{name}/{dataset}.ser', values,
+                       fmt=writhe.density_format(np.shape(values)[1] - 1))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or not os.path.exists(filename(sys.argv[1],
+                                                         'writhe')):
+        sys.exit(__doc__)
+    export_text(sys.argv[1])
@@ -26,10 +26,26 @@ Tests ensure consistency with WrLINE, not correctness.
 """  # noqa
 
 import filecmp
+import os
+import struct
 import sys
+import tempfile
 import numpy as np
+import batch
+import bench
 import caxislib
+import instrument
+import pipeline
+import store
+import trajectory
 import writhe
+import WrLINE
+
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    # The NetCDF reader is then not tested
+    netcdf_file = None
 
 try:
     from termcolor import colored
@@ -85,7 +101,295 @@ read_coords = writhe.read_3col(name + '/C1.3col', num_bp, num_steps)
 
 print("Calculating writhe")
 wr = writhe.writhe(read_coords, 2, len(read_coords[0]))
+tiled_wr = writhe.writhe_frames(writhe.close_curve(read_coords),
+                                len(read_coords[0]), block_size=50)
 full_writhe = writhe.main(name, num_bp, num_steps)
+exact_wr = writhe.writhe_frames(writhe.close_curve(read_coords),
+                                len(read_coords[0]), method='exact')
+tree_wr = writhe.main(name, num_bp, num_steps, write=False, method='tree')
+coarse_wr = writhe.main(name, num_bp, num_steps, write=False, method='exact',
+                        stride=4)
+
+# A (3, 4) torus knot, whose writhe is known analytically
+knot = bench.torus_knot(2000, 3, 4)[None]
+try:
+    writhe.calculate(knot, method='tree', theta=1.0)
+    wide_theta = False
+except ValueError:
+    wide_theta = True
+
+print("Analysing a chunk of frames")
+timings = {}
+chunk = pipeline.process(strand_a[:, 2:5], strand_b[:, 2:5],
+                         midpoints[:, 2:5], first_step=2, register=True,
+                         timings=timings)
+
+print("Storing results in binary")
+with tempfile.TemporaryDirectory() as directory:
+    datasets = store.create(directory, num_bp, 3,
+                            store.DATASETS + store.OPTIONAL)
+    for dataset, values in store.frames(midpoints[:, 2:5], chunk).items():
+        datasets[dataset][:] = values
+    del datasets
+    stored_wr = writhe.main(directory, num_bp, 3, write=False)
+    stored = store.Results(directory)
+    stored_axis = np.array(stored.axis(1, slice(10, 20)))
+    stored_sinreg = np.array(stored.select('sinreg', slice(0, 2), 5))
+    picked_sinreg = stored.select('sinreg', 1, np.array([5, 7]))
+    try:
+        stored.select('writhe', bps=np.array([5, 7]))
+        picked_series = None
+    except ValueError as error:
+        picked_series = str(error)
+    stored_num_bp = stored.num_bp
+    del stored
+    # A text axis from another run, of a different number of frames
+    with open(name + '/C1.3col', 'r') as source, \
+            open(directory + '/C1.3col', 'w') as copy:
+        copy.write(source.read())
+    try:
+        writhe.read_axis(directory, num_bp, 3)
+        mismatched_axes = False
+    except ValueError:
+        mismatched_axes = True
+    # Asked for explicitly, the binary axis is read without the text one
+    explicit_axis = writhe.read_axis(directory, num_bp, 3, binary=True)
+
+print("Exporting binary results as text")
+with tempfile.TemporaryDirectory() as directory:
+    # A run with register angles, then a shorter one without
+    for steps, angles in ((num_steps, True), (3, False)):
+        pipeline.run(directory, num_bp, steps, traj=name + '/C.mdcrd',
+                     num_atoms=2*num_bp, formats=('binary',),
+                     register=angles)
+    store.export_text(directory)
+    stale_register = (os.path.exists(directory + '/register.npy') or
+                      os.path.exists(directory + '/register.ser'))
+    exported_wr = np.loadtxt(directory + '/writhe.ser')
+
+print("Checkpointing & resuming a chunk of frames")
+with tempfile.TemporaryDirectory() as directory:
+    for run in range(2):
+        resumed = pipeline.process(strand_a[:, 2:5], strand_b[:, 2:5],
+                                   midpoints[:, 2:5], first_step=2,
+                                   checkpoint=directory)
+        checkpoint_files = [os.path.join(directory, checkpoint)
+                            for checkpoint in os.listdir(directory)]
+        if not run:
+            # Backdated, so that a stage saved again by the resumed run
+            # would show a new modification time
+            for checkpoint in checkpoint_files:
+                os.utime(checkpoint, ns=(0, 0))
+    checkpointed = len(checkpoint_files)
+    reloaded = all(os.stat(checkpoint).st_mtime_ns == 0
+                   for checkpoint in checkpoint_files)
+
+# One line of a .mdcrd trajectory, in 10F8.3 fixed-width form
+fixed_line = (b' 341.310  -1.500   0.000  -0.007 999.999-999.999'
+              b'  12.345  -0.250   7.001 -42.100')
+
+print("Measuring the memory used by each stage")
+stage_memory = {}
+with instrument.timer(stage_memory, 'large'):
+    np.ones(10**6)
+with instrument.timer(stage_memory, 'small'):
+    np.ones(10)
+
+print("Checking the layout of a trajectory")
+try:
+    caxislib.count_frames(name + '/C.mdcrd', 2*num_bp - 2)
+    wrong_layout = False
+except ValueError:
+    wrong_layout = True
+
+with tempfile.TemporaryDirectory() as directory:
+    try:
+        pipeline.run(directory, num_bp, 0, traj=name + '/C.mdcrd',
+                     num_atoms=2*num_bp)
+        no_frames = False
+    except ValueError:
+        no_frames = not os.listdir(directory)
+
+with tempfile.TemporaryDirectory() as directory:
+    with open(name + '/C.mdcrd', 'rb') as source, \
+            open(directory + '/C.mdcrd', 'wb') as copy:
+        copy.write(source.read())
+    try:
+        WrLINE.main([directory, 'none.prmtop', 'none.mdcrd',
+                     '--frame-start', str(num_steps + 2)])
+        past_end = False
+    except SystemExit:
+        past_end = not os.path.exists(directory + '/writhe.ser')
+    # Resumed after the topology & trajectory have been moved away
+    moved_wr = WrLINE.main([directory, 'none.prmtop', 'none.mdcrd',
+                            '--resume'])
+
+with tempfile.TemporaryDirectory() as directory:
+    with open(directory + '/C.mdcrd', 'w') as mdcrd:
+        mdcrd.write("Title only\n")
+    try:
+        caxislib.infer_atoms(directory + '/C.mdcrd')
+        title_only = False
+    except ValueError:
+        title_only = True
+    # 170 base pairs fill every line of a frame, and there is no box line,
+    # so the end of a frame can only be found from the topology
+    with open(directory + '/C.mdcrd', 'a') as mdcrd:
+        for frame in bench.synthetic(170, 2, turns=0):
+            values = frame.ravel()
+            for i in range(0, len(values), 10):
+                mdcrd.write(''.join(f'{value:8.3f}'
+                                    for value in values[i:i+10]) + '\n')
+    try:
+        caxislib.infer_atoms(directory + '/C.mdcrd')
+        full_lines = None
+    except ValueError:
+        bench.write_prmtop(directory + '/C1.prmtop', 340)
+        full_lines = WrLINE.main([directory, directory + '/C1.prmtop',
+                                  'none.mdcrd'])
+
+print("Analysing a synthetic trajectory")
+synthetic = caxislib.strands(bench.synthetic(num_bp, 2, turns=0), num_bp)
+synthetic = pipeline.process(*synthetic)
+
+print("Running a batch of jobs")
+with tempfile.TemporaryDirectory() as directory:
+    bench.write_prmtop(directory + '/C1.prmtop', 2*num_bp)
+    with open(directory + '/manifest', 'w') as manifest:
+        manifest.write(f"{directory}/job {directory}/C1.prmtop "
+                       f"{name}/C.mdcrd 0\n")
+    batch.main([directory + '/manifest', '--summary',
+                directory + '/summary.tsv'])
+    with open(directory + '/summary.tsv', 'r') as summary:
+        batch_summary = dict(zip(*(line.split('\t') for line in summary)))
+
+with tempfile.TemporaryDirectory() as directory:
+    # A stand-in for CPPTRAJ, which fails after writing to both streams
+    with open(directory + '/cpptraj', 'w') as cpptraj:
+        cpptraj.write("#! /bin/sh\necho stripping\necho failed >&2\nexit 1\n")
+    os.chmod(directory + '/cpptraj', 0o755)
+    # A topology of more atoms than the trajectory, so it must be stripped
+    bench.write_prmtop(directory + '/C1.prmtop', 2*num_bp + 2)
+    with open(directory + '/manifest', 'w') as manifest:
+        manifest.write(f"{directory}/job {directory}/C1.prmtop "
+                       f"{name}/C.mdcrd 0\n")
+    path = os.environ['PATH']
+    os.environ['PATH'] = directory + os.pathsep + path
+    try:
+        batch.main([directory + '/manifest', '--summary',
+                    directory + '/summary.tsv'])
+    finally:
+        os.environ['PATH'] = path
+    with open(f'{directory}/job/{batch.LOG}', 'r') as log:
+        batch_log = log.read()
+    try:
+        batch.main([directory + '/manifest', '--writhe-stride', '0',
+                    '--summary', directory + '/summary.tsv'])
+        batch_options = False
+    except SystemExit:
+        batch_options = True
+
+print("Following a trajectory")
+with tempfile.TemporaryDirectory() as directory:
+    followed_wr = pipeline.follow(directory, num_bp, num_steps + 1,
+                                  name + '/C.mdcrd', num_atoms=2*num_bp,
+                                  chunk_size=3, poll=0, timeout=0)
+
+print("Analysing every third frame of a trajectory")
+strided_coords = caxislib.read_frames(name + '/C.mdcrd', 2*num_bp, 1,
+                                      num_steps, step=3)
+with tempfile.TemporaryDirectory() as directory:
+    strided_wr = pipeline.run(directory, num_bp, 3, traj=name + '/C.mdcrd',
+                              num_atoms=2*num_bp, chunk_size=2,
+                              first_frame=1, frame_stride=3)
+
+print("Writing & reading a DCD trajectory")
+c1_coords = caxislib.read_mdcrd(name + '/C.mdcrd', 2*num_bp, 2)
+
+
+def fortran_record(data):
+    return struct.pack('i', len(data)) + data + struct.pack('i', len(data))
+
+
+with tempfile.TemporaryDirectory() as directory:
+    with open(directory + '/C.dcd', 'wb') as dcd:
+        dcd.write(fortran_record(b'CORD' + struct.pack('20i', 2, *[0]*19)))
+        dcd.write(fortran_record(struct.pack('i', 1) + b' ' * 80))
+        dcd.write(fortran_record(struct.pack('i', 2*num_bp)))
+        for frame in c1_coords:
+            for i in range(3):
+                dcd.write(fortran_record(frame[:, i].astype('f4').tobytes()))
+    dcd_coords = trajectory.read_frames(directory + '/C.dcd',
+                                        np.arange(num_bp), 0, 2)
+    try:
+        trajectory.read_frames(directory + '/C.dcd', np.arange(num_bp), 0, 5,
+                               step=2)
+        dcd_overrun = False
+    except ValueError:
+        dcd_overrun = True
+
+print("Pairing the atoms of a nicked, renumbered topology")
+# Strand A is nicked in two, and each of its chains numbered 3'-5'
+half = num_bp // 2
+order = np.concatenate((np.arange(half)[::-1], np.arange(half, num_bp)[::-1],
+                        np.arange(num_bp, 2*num_bp)))
+residue = np.argsort(order)
+links = [(k, k + 1) for k in range(2*num_bp - 1) if k not in (half - 1,
+                                                              num_bp - 1)]
+links.append((2*num_bp - 1, num_bp))
+nicked = {'ATOM_NAME': ["P", "O3'", "C1'"] * (2*num_bp),
+          'RESIDUE_POINTER': list(1 + 3*np.arange(2*num_bp)),
+          'BONDS_WITHOUT_HYDROGEN': [value for five, three in links
+                                     for value in (3*(3*residue[five] + 1),
+                                                   3*3*residue[three], 1)]}
+nicked_pairing = trajectory.topology_pairing(nicked)
+nicked_strands = caxislib.strands(c1_coords[:, order], num_bp,
+                                  pairing=nicked_pairing)
+with tempfile.TemporaryDirectory() as directory:
+    np.savetxt(directory + '/pairing', nicked_pairing.T + 1, fmt='%d',
+               header="strand A, strand B")
+    read_pairing = trajectory.read_pairing(directory + '/pairing', 2*num_bp)
+
+if netcdf_file is not None:
+    print("Writing & reading a NetCDF trajectory")
+    all_coords = caxislib.read_mdcrd(name + '/C.mdcrd', 2*num_bp)
+    with tempfile.TemporaryDirectory() as directory:
+        nc = netcdf_file(directory + '/C.nc', 'w', version=2)
+        nc.createDimension('frame', None)
+        nc.createDimension('spatial', 3)
+        nc.createDimension('atom', 2*num_bp)
+        nc.createVariable('spatial', 'c', ('spatial',))[:] = list('xyz')
+        nc.createVariable('time', 'f4', ('frame',))[:] = np.arange(num_steps)
+        nc.createVariable('coordinates', 'f4',
+                          ('frame', 'atom', 'spatial'))[:] = all_coords
+        nc.close()
+        nc_coords = trajectory.read_frames(directory + '/C.nc',
+                                           np.arange(num_bp), 1, num_steps,
+                                           step=3)
+        # A header not yet updated by the writer, and a partial last record
+        with open(directory + '/C.nc', 'r+b') as file:
+            file.seek(4)
+            file.write(struct.pack('>i', 3))
+            file.truncate(os.path.getsize(directory + '/C.nc') - 10)
+        nc_frames = trajectory.count_frames(directory + '/C.nc')
+
+print("Analysing coordinates in memory")
+analysed = pipeline.analyse(c1_coords)
+single = pipeline.analyse(c1_coords, dtype=np.float32)
+adaptive = pipeline.analyse(c1_coords, tolerance=0.3)
+adaptive_error = np.abs(adaptive['writhe'][:, 1] - analysed['writhe'][:, 1])
+profiled = pipeline.analyse(c1_coords, density=True)
+# A window covering the whole of an open segment of the axis
+segment = np.transpose(profiled['caxis'], (1, 2, 0))[:, :100]
+# A slowly drifting axis, as in a finely sampled trajectory
+drift = np.cumsum(np.random.default_rng(0).normal(0, 0.05, (30, num_bp, 3)),
+                  axis=0)
+drifting = np.transpose(analysed['caxis'], (1, 2, 0))[0] + drift
+try:
+    writhe.calculate(drifting[:2], incremental=0.3, refresh=0)
+    zero_refresh = False
+except ValueError:
+    zero_refresh = True
 
 # Linear
 
@@ -121,6 +425,15 @@ tests = {
                                    np.array([0, 0, 0]),
                                    np.array([1, 0, 0]),
                                    np.array([0, 0, 1])), -90],
+    "read DCD\t": [np.max(np.abs(dcd_coords - c1_coords[:, :num_bp])), 0],
+    "DCD overrun": [dcd_overrun, True],
+    "batch_twist": [caxislib.batch_twist(a1, a2, b1, b2, z), 71.997556736987],
+    "parse_fields": [sum(caxislib.parse_fields(
+        np.frombuffer(b' 341.310  -1.500 1234.56', np.uint8).reshape(3, 8))),
+        1574.37],
+    "parse 10F8.3": [np.array_equal(caxislib.parse_fields(
+        np.frombuffer(fixed_line, np.uint8).reshape(10, 8)),
+        [float(fixed_line[i:i+8]) for i in range(0, 80, 8)]), True],
     "read strand_a": [sum(sum(sum(strand_a))), 1057248.34],
     "read strand_b": [sum(sum(sum(strand_b))), 1057277.65],
     "read midpoints": [sum(sum(sum(midpoints))), 1057262.995],
@@ -133,9 +446,97 @@ tests = {
     "caxis lin": [sum(sum(linear_caxis[:, :, 150])),
                   sum(sum(caxis[:, :, 150]))],
     "sinreg\t": [sum(sum(sinreg)), 46.523100971271],
+    "topology pairing": [np.max(np.abs(np.array(nicked_strands) -
+                                       caxislib.strands(c1_coords, num_bp))),
+                         0],
+    "read pairing": [bool(np.all(read_pairing == nicked_pairing)), True],
     "read_3col": [sum(sum(sum(read_coords))), sum(sum(sum(caxis)))],
     "writhe.writhe": [wr, -1.013515045594],
+    "writhe tiled": [tiled_wr[2], wr],
     "writhe.main": [sum(sum(full_writhe)), 28.1093914578840],
+    "writhe exact": [exact_wr[2], -1.013468728],
+    "writhe tree": [bool(np.max(np.abs(tree_wr[:, 1] - full_writhe[:, 1]))
+                         < 1e-3), True],
+    "wide opening angle": [wide_theta, True],
+    "exact knot": [writhe.calculate(knot, method='exact')[0],
+                   bench.knot_writhe(3, 4)],
+    "adaptive exact knot": [writhe.calculate(knot, method='exact',
+                                             tolerance=0.001)[0],
+                            bench.knot_writhe(3, 4)],
+    # Within the change documented for --writhe-stride 4
+    "writhe coarse": [bool(np.max(np.abs(coarse_wr[:, 1] - exact_wr)) < 0.02),
+                      True],
+    "pipeline caxis": [sum(sum(sum(chunk['caxis']))),
+                       sum(sum(sum(caxis[:, 2:5])))],
+    "pipeline sinreg": [sum(sum(chunk['sinreg'])), sum(sum(sinreg[2:5]))],
+    "register angles": [np.sum(np.sin(np.radians(chunk['register'][:, 1:]))),
+                        np.sum(sinreg[2:5, 1:])],
+    "pipeline writhe": [sum(sum(chunk['writhe'])),
+                        sum(sum(full_writhe[2:5]))],
+    "timed stages": [sum(stage['frames'] for stage in timings.values()),
+                     6 * 3],
+    "checkpoint stages": [checkpointed, 5],
+    "checkpoints reloaded": [reloaded, True],
+    "large stage memory": [stage_memory['large']['peak_memory'] >= 8e6,
+                           True],
+    "small stage memory": [stage_memory['small']['peak_memory'] < 8e6,
+                           True],
+    "resumed writhe": [sum(sum(resumed['writhe'])),
+                       sum(sum(full_writhe[2:5]))],
+    "infer_atoms": [caxislib.infer_atoms(name + '/C.mdcrd'), 2*num_bp],
+    "wrong num_bp": [wrong_layout, True],
+    "no frames": [no_frames, True],
+    "start past end": [past_end, True],
+    "batch CPPTRAJ log": ['stripping' in batch_log and 'failed' in batch_log,
+                          True],
+    "batch options": [batch_options, True],
+    "resume without inputs": [len(moved_wr), num_steps],
+    "title only": [title_only, True],
+    "full lines": [len(full_lines), 2],
+    "analyse writhe": [sum(analysed['writhe'][:, 1]),
+                       sum(full_writhe[:2, 1])],
+    "single writhe": [sum(single['writhe'][:, 1]),
+                      sum(analysed['writhe'][:, 1])],
+    "single caxis": [np.max(np.abs(single['caxis'] - analysed['caxis'])),
+                     0],
+    # Dropping points within 0.3 Angstrom of a 336 bp axis; the estimated
+    # error of each frame is checked as a bound below
+    "adaptive writhe": [bool(np.max(adaptive_error) < 0.03), True],
+    "writhe error bound": [bool(np.all(adaptive_error <=
+                                       adaptive['writhe_error'][:, 1])), True],
+    "writhe density": [np.sum(profiled['writhe_density'][:, 1:]),
+                       sum(analysed['writhe'][:, 1])],
+    "local writhe": [np.sum(writhe.local_writhe(segment, True, window=201)
+                            [:, 50]),
+                     np.sum(writhe.calculate(segment, True))],
+    "zero refresh": [zero_refresh, True],
+    "incremental writhe": [bool(np.max(np.abs(
+        writhe.calculate(drifting, incremental=0.3) -
+        writhe.calculate(drifting))) < 1e-3), True],
+    "synthetic twist": [np.mean(synthetic['twist']), 360 / 10.5],
+    "synthetic writhe": [np.sum(synthetic['writhe'][:, 1]), 0],
+    "batch writhe": [float(batch_summary['writhe_mean']),
+                     np.mean(full_writhe[:, 1])],
+    "batch twist": [float(batch_summary['twist_mean']),
+                    np.mean(np.sum(twist, axis=1)) / 360],
+    "followed writhe": [sum(sum(followed_wr)), sum(sum(full_writhe))],
+    "strided read": [np.max(np.abs(strided_coords - caxislib.read_mdcrd(
+        name + '/C.mdcrd', 2*num_bp)[1::3])), 0],
+    "strided writhe": [sum(strided_wr[:, 1]), sum(full_writhe[1::3, 1])],
+    "store writhe": [sum(stored_wr[:, 1]), sum(full_writhe[2:5, 1])],
+    "store header": [stored_num_bp, num_bp],
+    "explicit binary axis": [np.max(np.abs(
+        explicit_axis[1, 10:20] - np.round(chunk['caxis'][:, 1, 10:20].T, 3))),
+        0],
+    "stale register": [stale_register, False],
+    "exported frames": [len(exported_wr), 3],
+    "mismatched axes": [mismatched_axes, True],
+    "store axis": [np.max(np.abs(stored_axis - chunk['caxis'][:, 1, 10:20].T)),
+                   0],
+    "store sinreg": [sum(stored_sinreg), sum(chunk['sinreg'][0:2, 6])],
+    "store picked bps": [sum(picked_sinreg), chunk['sinreg'][1, [6, 8]].sum()],
+    "store series bps": [picked_series == "writhe has no values per base pair",
+                         True],
     "C.3col\t": [filecmp.cmp(f'{name}/C.3col',
                              f'{name}/C.3col.original'), True],
     "C.xyz\t": [filecmp.cmp(f'{name}/C.xyz',
@@ -152,6 +553,11 @@ tests = {
                                f'{name}/writhe.ser.original'), True],
 }
 
+if netcdf_file is not None:
+    tests["read NetCDF"] = [np.max(np.abs(nc_coords -
+                                          all_coords[1::3, :num_bp])), 0]
+    tests["NetCDF frames"] = [nc_frames, num_steps - 1]
+
 pass_text = colored('[PASS]', 'green')
 fail_text = colored('[FAIL]', 'red')
 
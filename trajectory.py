@@ -0,0 +1,390 @@
+import re
+import numpy as np
+import caxislib
+
+# Trajectory formats recognised by file extension; anything else is .mdcrd
+FORMATS = {
+    '.nc': 'netcdf',
+    '.ncdf': 'netcdf',
+    '.netcdf': 'netcdf',
+    '.dcd': 'dcd',
+}
+
+# Name of the atoms used to represent each nucleotide
+ATOM_NAME = "C1'"
+
+
+# Topology
+
+
+def read_prmtop(filename):
+    """
+    Reads an AMBER topology (parm) file
+    Returns a dictionary of the values of each %FLAG section
+    """
+    sections = {}
+    flag = None
+    width = None
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.startswith('%FLAG'):
+                flag = line.split()[1]
+                sections[flag] = []
+            elif line.startswith('%FORMAT'):
+                # e.g. %FORMAT(20a4), %FORMAT(10I8) or %FORMAT(5E16.8)
+                match = re.search(r'\((\d+)([aAiIeE])(\d+)', line)
+                kind = match.group(2).lower()
+                width = int(match.group(3))
+            elif flag is not None and not line.startswith('%'):
+                line = line.rstrip('\n')
+                fields = [line[i:i+width] for i in range(0, len(line), width)]
+                if kind == 'a':
+                    sections[flag].extend(field.strip() for field in fields)
+                elif kind == 'i':
+                    sections[flag].extend(int(field) for field in fields)
+                else:
+                    sections[flag].extend(float(field) for field in fields)
+    return sections
+
+
+def select_atoms(topology, name=ATOM_NAME):
+    """
+    Returns the indices of all atoms with the given name,
+    in the order in which they appear in the topology
+    (i.e. the order in which CPPTRAJ would write them)
+    """
+    return np.flatnonzero(np.array(topology['ATOM_NAME']) == name)
+
+
+def residues(topology):
+    """
+    Returns the index of the residue to which each atom belongs
+    """
+    if 'RESIDUE_POINTER' not in topology:
+        raise ValueError("Topology has no RESIDUE_POINTER section")
+    # Pointers are to the first atom of each residue, counting from 1
+    first = np.array(topology['RESIDUE_POINTER']) - 1
+    return np.searchsorted(first, np.arange(len(topology['ATOM_NAME'])),
+                           side='right') - 1
+
+
+def chains(topology, name=ATOM_NAME):
+    """
+    Returns the chains of nucleotides linked by O3'-P bonds,
+    each a list of the positions of their atoms of the given name
+    among those returned by select_atoms, running 5'-3'
+    Chains are ordered by the first of their atoms in the topology
+    """
+    names = np.array(topology['ATOM_NAME'])
+    residue = residues(topology)
+    atoms = select_atoms(topology, name)
+    # Position of the named atom of each residue, or -1 if it has none
+    position = np.full(residue[-1] + 1, -1)
+    position[residue[atoms]] = np.arange(len(atoms))
+    # Bond indices are stored as three times the (0-based) atom index
+    bonds = np.reshape(np.array(topology.get('BONDS_WITHOUT_HYDROGEN', []),
+                                dtype=int), (-1, 3))[:, :2] // 3
+    bonds = np.concatenate((bonds, bonds[:, ::-1]))
+    links = bonds[(names[bonds[:, 0]] == "O3'") &
+                  (names[bonds[:, 1]] == 'P')]
+    five, three = position[residue[links]].T
+    linked = (five >= 0) & (three >= 0) & (five != three)
+    following = np.full(len(atoms), -1)
+    following[five[linked]] = three[linked]
+    has_previous = np.zeros(len(atoms), dtype=bool)
+    has_previous[three[linked]] = True
+
+    found = []
+    visited = np.zeros(len(atoms), dtype=bool)
+    # Strands with a 5' end first; any left over are closed circles
+    for first in np.concatenate((np.flatnonzero(~has_previous),
+                                 np.arange(len(atoms)))):
+        chain = []
+        atom = first
+        while atom >= 0 and not visited[atom]:
+            visited[atom] = True
+            chain.append(atom)
+            atom = following[atom]
+        if chain:
+            found.append(chain)
+    return sorted(found, key=min)
+
+
+def topology_pairing(topology, name=ATOM_NAME):
+    """
+    Returns the pairing index (see caxislib.default_pairing)
+    of the atoms with the given name, from the chains of the topology
+    Each strand is made of whole chains, taken in order:
+    strand A of the first half of the nucleotides, and strand B the rest,
+    so a nicked strand may be split into several chains,
+    and the nucleotides of each chain may be numbered in any order
+    The 3' end of strand B is paired with the 5' end of strand A
+    """
+    found = chains(topology, name)
+    lengths = np.cumsum([len(chain) for chain in found])
+    split = np.searchsorted(lengths, lengths[-1] / 2) if found else 0
+    if not found or lengths[split] != lengths[-1] / 2:
+        raise ValueError(f"Cannot split the {len(found)} chains of the "
+                         "topology into two strands of equal length")
+    strand_a = np.concatenate(found[:split + 1])
+    strand_b = np.concatenate(found[split + 1:])
+    return np.array([strand_a, strand_b[::-1]])
+
+
+def read_pairing(filename, num_atoms):
+    """
+    Reads a pairing index (see caxislib.default_pairing)
+    of num_atoms atoms from a file,
+    each line of which gives the positions (counting from 1)
+    among the C1' atoms of the two atoms of one base pair,
+    strand A then strand B, in order along strand A 5'-3'
+    Blank lines, and lines beginning with #, are ignored
+    """
+    pairs = np.loadtxt(filename, dtype=int, comments='#', ndmin=2)
+    if pairs.shape[1] != 2:
+        raise ValueError(f"{filename}: expected two atoms per line")
+    return caxislib.check_pairing(pairs.T - 1, num_atoms)
+
+
+# Binary trajectories
+
+
+def _netcdf_header(data):
+    """
+    Parses the header of a NetCDF classic or 64-bit offset file
+    Returns the number of records, the dimensions (name: length)
+    and the variables (name: (dimension names, type, vsize, begin))
+    """
+    if bytes(data[:3]) != b'CDF' or data[3] not in (1, 2):
+        raise ValueError("Not a NetCDF classic or 64-bit offset file")
+    offset_type = '>i4' if data[3] == 1 else '>i8'
+    position = 4
+
+    def read(dtype):
+        nonlocal position
+        value = np.frombuffer(data[position:position + np.dtype(dtype)
+                                   .itemsize], dtype=dtype)[0]
+        position += np.dtype(dtype).itemsize
+        return int(value)
+
+    def read_name():
+        nonlocal position
+        length = read('>i4')
+        name = bytes(data[position:position + length]).decode()
+        position += -(-length // 4) * 4
+        return name
+
+    # Sizes of NC_BYTE, NC_CHAR, NC_SHORT, NC_INT, NC_FLOAT & NC_DOUBLE
+    sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8}
+
+    def skip_attributes():
+        nonlocal position
+        read('>i4')
+        for _ in range(read('>i4')):
+            read_name()
+            nc_type = read('>i4')
+            length = read('>i4') * sizes[nc_type]
+            position += -(-length // 4) * 4
+
+    num_records = read('>i4') & 0xFFFFFFFF
+    read('>i4')
+    dimensions = {}
+    for _ in range(read('>i4')):
+        name = read_name()
+        dimensions[name] = read('>i4')
+    dimension_names = list(dimensions)
+    skip_attributes()
+    read('>i4')
+    variables = {}
+    for _ in range(read('>i4')):
+        name = read_name()
+        dims = [dimension_names[read('>i4')] for _ in range(read('>i4'))]
+        skip_attributes()
+        nc_type = read('>i4')
+        vsize = read('>i4')
+        begin = read(offset_type)
+        variables[name] = (dims, nc_type, vsize, begin)
+    return num_records, dimensions, variables
+
+
+def netcdf_layout(filename):
+    """
+    Memory-maps an AMBER NetCDF trajectory
+    Returns the mapped bytes, the offset of the coordinates of the first
+    frame, the length of each record in bytes, the number of atoms
+    and the number of complete frames
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    _, dimensions, variables = _netcdf_header(data)
+    if 'coordinates' not in variables:
+        raise ValueError(f"{filename} has no coordinates variable")
+    dims, nc_type, vsize, begin = variables['coordinates']
+    if nc_type != 5 or dims != ['frame', 'atom', 'spatial']:
+        raise ValueError(f"{filename} is not an AMBER NetCDF trajectory")
+    # Scalar variables (with no dimensions) are not stored per record
+    record_variables = [v for v in variables.values()
+                        if v[0] and dimensions[v[0][0]] == 0]
+    if len(record_variables) == 1:
+        record_bytes = 12 * dimensions['atom']
+    else:
+        record_bytes = sum(v[2] for v in record_variables)
+    # The number of records in the header is only updated when the writer
+    # syncs it (and is -1 while streaming), so it may lag behind a file
+    # still being written; frames are instead counted from the size of the
+    # file, as every record whose coordinates have been written in full,
+    # including any written since the header was last updated
+    last = len(data) - begin - 12 * dimensions['atom']
+    num_frames = last // record_bytes + 1 if last >= 0 else 0
+    return data, begin, record_bytes, dimensions['atom'], num_frames
+
+
+def dcd_layout(filename):
+    """
+    Memory-maps a CHARMM/NAMD DCD trajectory
+    Returns the mapped bytes, the offset of the first frame,
+    the length of each frame in bytes, the number of atoms,
+    the number of complete frames, the byte order,
+    and the length in bytes of any unit cell record preceding each frame
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    for order in '<>':
+        if np.frombuffer(data[:4], dtype=order + 'i4')[0] == 84:
+            break
+    else:
+        raise ValueError(f"{filename} is not a DCD trajectory")
+    integer = np.dtype(order + 'i4')
+    if bytes(data[4:8]) != b'CORD':
+        raise ValueError(f"{filename} is not a DCD trajectory")
+    control = np.frombuffer(data[8:88], dtype=integer)
+    if control[8]:
+        raise ValueError(f"{filename} has fixed atoms, which are unsupported")
+    # CHARMM-style files may store the unit cell before each frame
+    cell_bytes = 56 if control[19] and control[10] else 0
+    if control[19] and control[11]:
+        raise ValueError(f"{filename} has 4D coordinates, "
+                         "which are unsupported")
+    position = 92
+    title_bytes = np.frombuffer(data[position:position + 4], dtype=integer)
+    position += int(title_bytes[0]) + 8
+    num_atoms = int(np.frombuffer(data[position + 4:position + 8],
+                                  dtype=integer)[0])
+    position += 12
+    frame_bytes = cell_bytes + 3 * (4 * num_atoms + 8)
+    num_frames = (len(data) - position) // frame_bytes
+    return data, position, frame_bytes, num_atoms, num_frames, order, \
+        cell_bytes
+
+
+def _count(start, stop, step, num_frames):
+    """
+    Returns the number of frames in range(start, stop, step),
+    having checked that all of them are among the num_frames complete frames
+    """
+    count = len(range(start, stop, step))
+    if count and (start < 0 or start + (count - 1)*step >= num_frames):
+        raise ValueError(f"Frames {start} to {stop} in steps of {step} "
+                         f"are not all among the {num_frames} complete "
+                         "frames of the trajectory")
+    return count
+
+
+def read_netcdf(filename, atoms, start, stop, dtype=np.float64, step=1):
+    """
+    Reads the coordinates of the given atom indices
+    from every step-th frame of frames [start, stop)
+    of an AMBER NetCDF trajectory
+    Returns an array of shape (len(range(start, stop, step)), len(atoms), 3)
+    """
+    data, begin, record_bytes, num_atoms, num_frames = \
+        netcdf_layout(filename)
+    count = _count(start, stop, step, num_frames)
+    records = np.lib.stride_tricks.as_strided(
+        data[begin + start*record_bytes:],
+        shape=(count, num_atoms, 12),
+        strides=(step*record_bytes, 12, 1))
+    selected = np.ascontiguousarray(records[:, atoms])
+    return selected.view('>f4').astype(dtype)
+
+
+def read_dcd(filename, atoms, start, stop, dtype=np.float64, step=1):
+    """
+    Reads the coordinates of the given atom indices
+    from every step-th frame of frames [start, stop) of a DCD trajectory
+    Returns an array of shape (len(range(start, stop, step)), len(atoms), 3)
+    """
+    data, offset, frame_bytes, num_atoms, num_frames, order, cell_bytes = \
+        dcd_layout(filename)
+    count = _count(start, stop, step, num_frames)
+    # Each frame is three records (x, y, z), each with 4-byte markers
+    first = offset + start*frame_bytes + cell_bytes + 4
+    records = np.lib.stride_tricks.as_strided(
+        data[first:],
+        shape=(count, 3, num_atoms, 4),
+        strides=(step*frame_bytes, 4 * num_atoms + 8, 4, 1))
+    selected = np.ascontiguousarray(records[:, :, atoms])
+    coords = selected.view(order + 'f4')[..., 0]
+    return np.transpose(coords, (0, 2, 1)).astype(dtype)
+
+
+# Any format
+
+
+def trajectory_format(filename):
+    """
+    Returns the format of a trajectory, judged by its file extension
+    """
+    for extension, fmt in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    return 'mdcrd'
+
+
+def count_atoms(filename, max_atoms=None):
+    """
+    Returns the number of atoms per frame of a trajectory
+    (for .mdcrd, inferred from the layout of the first frame,
+    scanning no more than a frame of max_atoms atoms if it is given)
+    """
+    fmt = trajectory_format(filename)
+    if fmt == 'netcdf':
+        return netcdf_layout(filename)[3]
+    if fmt == 'dcd':
+        return dcd_layout(filename)[3]
+    return caxislib.infer_atoms(filename, max_atoms)
+
+
+def count_frames(filename, num_atoms=None):
+    """
+    Returns the number of complete frames in a trajectory
+    num_atoms (the number of atoms per frame) is only needed for .mdcrd,
+    which is checked to be laid out accordingly
+    """
+    fmt = trajectory_format(filename)
+    if fmt == 'netcdf':
+        return netcdf_layout(filename)[4]
+    if fmt == 'dcd':
+        return dcd_layout(filename)[4]
+    return caxislib.count_frames(filename, num_atoms)
+
+
+def read_frames(filename, atoms, start, stop, num_atoms=None,
+                dtype=np.float64, step=1):
+    """
+    Reads the coordinates of the given atom indices
+    (or all atoms, if atoms is None)
+    from every step-th frame of frames [start, stop)
+    of a trajectory in any supported format,
+    reading only the bytes of the frames selected
+    Returns an array of shape (len(range(start, stop, step)), len(atoms), 3)
+    num_atoms (the number of atoms per frame) is only needed for .mdcrd
+    """
+    fmt = trajectory_format(filename)
+    if fmt == 'mdcrd':
+        coords = caxislib.read_frames(filename, num_atoms, start, stop, dtype,
+                                      step)
+        return coords if atoms is None else coords[:, atoms]
+    if atoms is None:
+        atoms = slice(None)
+    if fmt == 'netcdf':
+        return read_netcdf(filename, atoms, start, stop, dtype, step)
+    return read_dcd(filename, atoms, start, stop, dtype, step)
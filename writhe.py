@@ -1,4 +1,28 @@
+import os
 import numpy as np
+import store
+
+# Number of segments along each edge of a tile of the pair matrix
+BLOCK_SIZE = 128
+# Maximum number of pair contributions (frames * tile) held in memory at once
+MAX_PAIRS = 2**20
+# Maximum number of segments in a leaf of the octree used by tree_writhe
+LEAF_SIZE = 16
+# Default opening angle for tree_writhe
+THETA = 0.3
+# Maximum number of points of the axis spanned by one segment
+# of an adaptively decimated axis
+MAX_SPAN = 32
+# Format of each row of writhe.ser
+FORMAT = '%5d %9.4f'
+# Format of each value of writhe_density.ser & local_writhe.ser
+DENSITY_FORMAT = '%10.6f'
+# Default number of frames between full recalculations of writhe
+# by incremental_writhe
+REFRESH = 20
+# Default number of points in the window about each point of the axis
+# within which local writhe is calculated
+LOCAL_WINDOW = 51
 
 
 def read_3col(filename, num_bp, num_steps):
@@ -14,42 +38,773 @@ def read_3col(filename, num_bp, num_steps):
     return np.array(x)
 
 
-def writhe(coords, t, length, axis=2, linear=False):
+def count_lines(filename, chunk_bytes=2**24):
+    """
+    Returns the number of lines in a text file, read a chunk at a time
+    """
+    lines = 0
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_bytes), b''):
+            lines += chunk.count(b'\n')
+    return lines
+
+
+def read_axis(name, num_bp, num_steps, binary=None):
+    """
+    Reads the helical axis of each timestep from name,
+    from the binary caxis.npy if binary, or from C1.3col if not
+    By default (binary None), caxis.npy is read if the header of the store
+    lists it (i.e. the latest run wrote binary output; see store),
+    or if C1.3col does not exist,
+    and ValueError is raised if both files exist but hold axes
+    of different shapes
+    The binary axis is rounded as it would be in C1.3col,
+    so writhe does not depend on the format of the output
+    """
+    npy = store.filename(name, 'caxis')
+    text = name + '/C1.3col'
+    if binary is None:
+        if os.path.exists(npy) and os.path.exists(text):
+            num_frames, num_points = np.shape(np.load(npy,
+                                                      mmap_mode='r'))[:2]
+            if count_lines(text) != num_frames * num_points:
+                raise ValueError(f"{npy} ({num_frames} frames of "
+                                 f"{num_points} points) and {text} hold "
+                                 f"different axes")
+        binary = (not os.path.exists(text) or
+                  (os.path.exists(f'{name}/{store.HEADER}') and
+                   'caxis' in store.read_header(name)['datasets']))
+    if binary:
+        return np.round(np.load(npy, mmap_mode='r')[:num_steps], 3)
+    return read_3col(text, num_bp, num_steps)
+
+
+def close_curve(coords, linear=False):
+    """
+    Returns an array of frames of points along the curve,
+    with the head repeated at the tail if the curve is closed
+        coords has shape (num_frames, num_points, 3)
+    """
+    if linear:
+        return np.asarray(coords)
+    return np.concatenate((coords, coords[:, :1]), axis=1)
+
+
+def floating(y):
+    """
+    Returns y as an array of floating-point values,
+    keeping single precision if it is given in single precision
+    """
+    y = np.asarray(y)
+    return y if y.dtype in (np.float32, np.float64) else y.astype(np.float64)
+
+
+def gauss_block(y_j, t_j, y_k, t_k):
+    """
+    Contributions of each pair of segments in a tile of the pair matrix
+    to the discretised Gauss integral
+        y_j & y_k have shape (num_frames, n, 3) and are the segment origins
+        t_j & t_k have the same shape and are the segment tangents
+    Returns an array of shape (num_frames, n_j, n_k)
+    """
+    # Vector joining j and k
+    rx = y_j[:, :, None, 0] - y_k[:, None, :, 0]
+    ry = y_j[:, :, None, 1] - y_k[:, None, :, 1]
+    rz = y_j[:, :, None, 2] - y_k[:, None, :, 2]
+    # r . (t_j x t_k), expanded to avoid building (..., 3) temporaries
+    triple = (rx * (t_j[:, :, None, 1] * t_k[:, None, :, 2] -
+                    t_j[:, :, None, 2] * t_k[:, None, :, 1]) +
+              ry * (t_j[:, :, None, 2] * t_k[:, None, :, 0] -
+                    t_j[:, :, None, 0] * t_k[:, None, :, 2]) +
+              rz * (t_j[:, :, None, 0] * t_k[:, None, :, 1] -
+                    t_j[:, :, None, 1] * t_k[:, None, :, 0]))
+    distance = np.sqrt(rx*rx + ry*ry + rz*rz)
+    return triple / (distance * distance * distance * 2 * np.pi)
+
+
+def _unit_cross(a, b):
+    """
+    Normalised cross products of arrays of vectors stored as (x, y, z) tuples
+    Degenerate (parallel or zero) inputs give NaN
+    """
+    c = (a[1]*b[2] - a[2]*b[1],
+         a[2]*b[0] - a[0]*b[2],
+         a[0]*b[1] - a[1]*b[0])
+    length = np.sqrt(c[0]*c[0] + c[1]*c[1] + c[2]*c[2])
+    return tuple(x / length for x in c)
+
+
+def _asin_dot(a, b):
+    """
+    arcsin of the dot product of two unit vectors, clipped to a valid range
+    """
+    return np.arcsin(np.clip(a[0]*b[0] + a[1]*b[1] + a[2]*b[2], -1.0, 1.0))
+
+
+def exact_block(y_j, t_j, y_k, t_k):
+    """
+    Contributions of each pair of segments in a tile of the pair matrix
+    to the writhe, using the exact solid angle subtended by the pair
+    (Klenin K & Langowski J 2000 Biopolymers 54 307-17)
+        Arguments and return value are as for gauss_block
+    Pairs of segments that share a point contribute nothing
+    """
+    # Vectors between the start and end points of segment j (1, 2)
+    # and segment k (3, 4)
+    # Each is built from r13 and the tangents, rather than from the end
+    # points, so that the vector between a point shared by adjacent
+    # segments (whose tangents are differences of the same points)
+    # is exactly zero, and the pair is dropped below
+    r13 = [y_k[:, None, :, i] - y_j[:, :, None, i] for i in range(3)]
+    r14 = [r13[i] + t_k[:, None, :, i] for i in range(3)]
+    r23 = [r13[i] - t_j[:, :, None, i] for i in range(3)]
+    r24 = [r14[i] - t_j[:, :, None, i] for i in range(3)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Normals to the faces of the quadrilateral joining the segments
+        n1 = _unit_cross(r13, r14)
+        n2 = _unit_cross(r14, r24)
+        n3 = _unit_cross(r24, r23)
+        n4 = _unit_cross(r23, r13)
+        omega = (_asin_dot(n1, n2) + _asin_dot(n2, n3) +
+                 _asin_dot(n3, n4) + _asin_dot(n4, n1))
+    # The sign is that of (t_k x t_j) . r13
+    sign = np.sign(r13[0] * (t_k[:, None, :, 1] * t_j[:, :, None, 2] -
+                             t_k[:, None, :, 2] * t_j[:, :, None, 1]) +
+                   r13[1] * (t_k[:, None, :, 2] * t_j[:, :, None, 0] -
+                             t_k[:, None, :, 0] * t_j[:, :, None, 2]) +
+                   r13[2] * (t_k[:, None, :, 0] * t_j[:, :, None, 1] -
+                             t_k[:, None, :, 1] * t_j[:, :, None, 0]))
+    # Each unordered pair is counted once, hence 2 / 4pi
+    return np.where(np.isfinite(omega), omega * sign, 0.0) / (2 * np.pi)
+
+
+def build_octree(points, leaf_size=LEAF_SIZE):
+    """
+    Builds an octree over an array of points of shape (n, 3)
+    Returns a dictionary of per-cell arrays and the permutation of the
+    points such that every cell covers a contiguous range of it;
+    the children of each cell are likewise contiguous
+    """
+    order = np.arange(len(points))
+    lower = np.min(points, axis=0)
+    upper = np.max(points, axis=0)
+    # Cells are appended breadth-first, starting with the root
+    start = [0]
+    end = [len(points)]
+    first_child = [0]
+    num_children = [0]
+    centre = [0.5 * (lower + upper)]
+    half = [0.5 * np.max(upper - lower)]
+    i = 0
+    while i < len(start):
+        s, e = start[i], end[i]
+        if e - s > leaf_size and half[i] > 1e-9:
+            # Sort the points of this cell by octant
+            cell_points = points[order[s:e]]
+            code = ((cell_points[:, 0] > centre[i][0]) * 1 +
+                    (cell_points[:, 1] > centre[i][1]) * 2 +
+                    (cell_points[:, 2] > centre[i][2]) * 4)
+            sort = np.argsort(code, kind='stable')
+            order[s:e] = order[s:e][sort]
+            counts = np.bincount(code, minlength=8)
+            first_child[i] = len(start)
+            offset = s
+            for octant in range(8):
+                if counts[octant]:
+                    sign = np.array([octant & 1, octant & 2, octant & 4])
+                    start.append(offset)
+                    end.append(offset + counts[octant])
+                    first_child.append(0)
+                    num_children.append(0)
+                    centre.append(centre[i] +
+                                  0.5 * half[i] * np.where(sign, 1, -1))
+                    half.append(0.5 * half[i])
+                    num_children[i] += 1
+                    offset += counts[octant]
+        i += 1
+    tree = {
+        'start': np.array(start),
+        'end': np.array(end),
+        'first_child': np.array(first_child),
+        'num_children': np.array(num_children),
+        'centre': np.array(centre),
+        'half': np.array(half),
+    }
+    return tree, order
+
+
+def _expand(targets, first, count):
+    """
+    Given pairs of (target, range of count items starting at first),
+    returns the flattened pairs of (target, item)
+    """
+    total = np.sum(count)
+    targets = np.repeat(targets, count)
+    offsets = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+    return targets, np.repeat(first, count) + offsets
+
+
+def tree_writhe(y, length, theta=THETA, leaf_size=LEAF_SIZE, density=False):
+    """
+    Calculates writhe for a single timestep using a Barnes-Hut octree
+        y has shape (num_points, 3), as for writhe_frames
+        theta is the opening angle; cells whose bounding radius is less than
+            theta times their distance from a segment are replaced by their
+            aggregated tangents (monopole & dipole terms);
+            smaller values are more accurate, and 0 gives the Gauss result;
+            it must be less than 1, or a cell holding the segment itself
+            could be treated as distant
+    Writhe is the sum over segments j of t_j . B(p_j) / 4pi, where B is the
+    Biot-Savart-like field of all other tangents;
+    all segments are traversed down the tree together
+    With density, returns the term of each segment j instead of their sum
+    """
+    if not 0 <= theta < 1:
+        raise ValueError(f"The opening angle must be at least 0 "
+                         f"and less than 1, not {theta}")
+    y = floating(y)
+    tangents = y[1:length+1] - y[:length]
+    origins = y[:length]
+    tree, order = build_octree(origins, leaf_size)
+    p = origins[order]
+    t = tangents[order]
+
+    # Cell moments from prefix sums over the permuted segments
+    def range_sum(values):
+        cumulative = np.concatenate((np.zeros((1,) + np.shape(values)[1:]),
+                                     np.cumsum(values, axis=0,
+                                               dtype=np.float64)))
+        return cumulative[tree['end']] - cumulative[tree['start']]
+    count = (tree['end'] - tree['start'])[:, None]
+    total_t = range_sum(t)
+    centroid = range_sum(p) / count
+    # Dipole tensor sum_k t_k (p_k - c)^T
+    dipole = (range_sum(t[:, :, None] * p[:, None, :]) -
+              total_t[:, :, None] * centroid[:, None, :])
+    # Bounding radius of each cell about its centroid
+    radius = np.sqrt(np.sum((tree['half'][:, None] +
+                             np.abs(centroid - tree['centre']))**2, axis=1))
+    is_leaf = tree['num_children'] == 0
+
+    field = np.zeros((length, 3))
+    targets = np.arange(length)
+    cells = np.zeros(length, dtype=int)
+    while len(targets):
+        r = p[targets] - centroid[cells]
+        distance = np.sqrt(np.sum(r * r, axis=1))
+        far = radius[cells] < theta * distance
+        # Far field: monopole and dipole of the cell
+        if np.any(far):
+            r_far = r[far]
+            d = distance[far][:, None]
+            g = r_far / d**3
+            contribution = np.cross(total_t[cells[far]], g)
+            # Gradient of g, contracted with the dipole tensor
+            grad = (np.eye(3) / d[:, :, None]**3 -
+                    3 * r_far[:, :, None] * r_far[:, None, :] /
+                    d[:, :, None]**5)
+            q = np.matmul(dipole[cells[far]], grad)
+            contribution -= np.stack((q[:, 1, 2] - q[:, 2, 1],
+                                      q[:, 2, 0] - q[:, 0, 2],
+                                      q[:, 0, 1] - q[:, 1, 0]), axis=1)
+            for i in range(3):
+                field[:, i] += np.bincount(targets[far], contribution[:, i],
+                                           minlength=length)
+        # Near field: direct sum over the segments of rejected leaves
+        near = ~far & is_leaf[cells]
+        if np.any(near):
+            leaves = cells[near]
+            pair_targets, sources = _expand(
+                targets[near], tree['start'][leaves],
+                tree['end'][leaves] - tree['start'][leaves])
+            keep = pair_targets != sources
+            pair_targets = pair_targets[keep]
+            sources = sources[keep]
+            r_near = p[pair_targets] - p[sources]
+            d = np.sqrt(np.sum(r_near * r_near, axis=1))[:, None]
+            contribution = np.cross(t[sources], r_near / d**3)
+            for i in range(3):
+                field[:, i] += np.bincount(pair_targets, contribution[:, i],
+                                           minlength=length)
+        # Otherwise, open the cell
+        split = ~far & ~is_leaf[cells]
+        targets, cells = _expand(targets[split],
+                                 tree['first_child'][cells[split]],
+                                 tree['num_children'][cells[split]])
+    if density:
+        # The contribution of each segment, in the original order
+        contributions = np.empty(length)
+        contributions[order] = np.sum(t * field, axis=1) / (4 * np.pi)
+        return contributions
+    return np.sum(t * field) / (4 * np.pi)
+
+
+# Pairwise kernels selectable by name
+METHODS = {
+    'gauss': gauss_block,
+    'exact': exact_block,
+}
+
+
+def writhe_frames(y, length, block_size=BLOCK_SIZE, method='gauss',
+                  theta=THETA, density=False):
+    """
+    Calculates writhe for a stack of timesteps
+        y has shape (num_frames, num_points, 3) and must contain at least
+            length + 1 points, e.g. as returned by close_curve
+        length is the number of segments to include
+        method is the name of the pairwise kernel to use (see METHODS),
+            or 'tree' to use tree_writhe with opening angle theta
+    The pair matrix is evaluated in square tiles of block_size segments,
+    so memory use is bounded independently of the length of the curve
+    Single-precision y is kept in single precision within each tile,
+    but the writhe of each frame is summed in double precision
+    With density, returns instead the contribution of each segment
+    (half the row & column sums of the pair matrix, which sum to the writhe)
+    of shape (num_frames, length), accumulated in the same pass
+    """
+    if method == 'tree':
+        return np.array([tree_writhe(frame, length, theta, density=density)
+                         for frame in y])
+    try:
+        kernel = METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown writhe method {method!r}; "
+                         f"expected one of {', '.join(METHODS)} or tree")
+    y = floating(y)
+    num_frames = np.shape(y)[0]
+    tangents = y[:, 1:length+1] - y[:, :length]
+    origins = y[:, :length]
+    # Split the frames such that each tile fits within MAX_PAIRS
+    frame_step = max(1, MAX_PAIRS // block_size**2)
+    result = np.zeros(num_frames)
+    if density:
+        contributions = np.zeros((num_frames, length))
+    for f in range(0, num_frames, frame_step):
+        frames = slice(f, f + frame_step)
+        for j in range(0, length, block_size):
+            y_j = origins[frames, j:j+block_size]
+            t_j = tangents[frames, j:j+block_size]
+            # Only tiles on or below the diagonal contribute (k < j)
+            for k in range(0, j + 1, block_size):
+                y_k = origins[frames, k:k+block_size]
+                t_k = tangents[frames, k:k+block_size]
+                if k == j:
+                    # Diagonal tile; keep only the strict lower triangle
+                    n = np.shape(y_j)[1]
+                    rows, cols = np.tril_indices(n, -1)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        block = kernel(y_j, t_j, y_k, t_k)
+                    result[frames] += np.sum(block[:, rows, cols], axis=1,
+                                             dtype=np.float64)
+                    if density:
+                        block = np.where(np.tri(n, k=-1, dtype=bool),
+                                         block, 0.0)
+                else:
+                    block = kernel(y_j, t_j, y_k, t_k)
+                    result[frames] += np.sum(block, axis=(1, 2),
+                                             dtype=np.float64)
+                if density:
+                    # Each pair is shared equally between its segments
+                    contributions[frames, j:j+block_size] += 0.5 * np.sum(
+                        block, axis=2, dtype=np.float64)
+                    contributions[frames, k:k+block_size] += 0.5 * np.sum(
+                        block, axis=1, dtype=np.float64)
+    return contributions if density else result
+
+
+def writhe(coords, t, length, axis=2, linear=False, block_size=BLOCK_SIZE):
     """
     Calculates write for a single timestep
     """
-    shape = np.shape(coords[t])
-    y = np.zeros((shape[0]+(0 if linear else 1), shape[1]))
-    # Read one bp-step
-    y[:shape[0], :] = coords[t]
-    if not linear:
-        # Add the head at the bottom
-        y[shape[0], :] = coords[t, 0]
-    result = 0
-    for j in range(length):
-        for k in range(j):
-            tangents_j = y[j+1] - y[j]
-            tangents_k = y[k+1] - y[k]
-            # Vector joining j and k
-            vector = y[j] - y[k]
-            # Discretised Gauss integral
-            # Add each individual contribution from a pair of tangent vectors
-            result += (np.dot(vector, np.cross(tangents_j, tangents_k)) /
-                       (np.linalg.norm(vector)**3 * 2 * np.pi))
+    y = close_curve(coords[t:t+1], linear)
+    return writhe_frames(y, length, block_size)[0]
+
+
+def coarse_grain(coords, stride, linear=False):
+    """
+    Keeps every stride-th point along the curve
+    The end points of open curves are always kept
+    """
+    sampled = coords[:, ::stride]
+    if linear and (np.shape(coords)[1] - 1) % stride:
+        sampled = np.concatenate((sampled, coords[:, -1:]), axis=1)
+    return sampled
+
+
+def decimate(coords, tolerance, linear=False, max_span=MAX_SPAN):
+    """
+    Returns the indices of the points along the curve
+    kept by adaptive decimation
+        coords has shape (num_frames, num_points, 3)
+    Walking along the curve, each segment is extended (up to max_span points)
+    for as long as every point it skips lies within tolerance
+    of the segment in every frame;
+    as that distance grows with the curvature times the square of the length,
+    points are kept densely only where the curve bends sharply
+    The first point, and the last point of open curves, are always kept
+    """
+    num_points = np.shape(coords)[1]
+    curve = close_curve(coords, linear)
+    last = np.shape(curve)[1] - 1
+    kept = [0]
+    i = 0
+    while i < last:
+        # Each point of the window relative to its first point,
+        # as the end of a candidate segment (e) & as a skipped point (p)
+        window = curve[:, i:min(i + max_span, last) + 1] - curve[:, i:i+1]
+        ends = window[:, :, None]
+        points = window[:, None, :]
+        # Distance of each point from each segment
+        along = np.clip(np.sum(points * ends, axis=3) /
+                        np.maximum(np.sum(ends * ends, axis=3), 1e-12),
+                        0.0, 1.0)
+        distance = np.sqrt(np.sum((points - along[..., None] * ends)**2,
+                                  axis=3))
+        # Only points before the end of each segment are skipped
+        width = np.shape(window)[1]
+        skipped = np.arange(width)[None, :] < np.arange(width)[:, None]
+        worst = np.max(np.where(skipped, distance, 0.0), axis=(0, 2))
+        # The segment to the next point skips nothing, so is always allowed
+        too_far = np.nonzero(worst[2:] > tolerance)[0]
+        i += too_far[0] + 1 if len(too_far) else width - 1
+        kept.append(i)
+    kept = np.array(kept)
+    # The head of a closed curve is not repeated
+    return kept[kept < num_points]
+
+
+def _tiles(values, segments):
+    """
+    Returns the given segments of every frame as 1 x 1 tiles,
+    so that a kernel evaluates only the pairs of corresponding segments
+    """
+    return np.reshape(values[:, segments], (-1, 1, 3))
+
+
+def near_writhe(y, index, num_points, linear=False, method='gauss',
+                band=MAX_SPAN):
+    """
+    Sums the contributions to writhe of the pairs of segments
+    whose first points are fewer than band points apart along the curve
+        y has shape (num_frames, len(index) + 1, 3), as given by close_curve
+            (or len(index) points if linear)
+        index is the position along the full curve of each point of y,
+            which has num_points points
+    """
+    kernel = METHODS.get(method, gauss_block)
+    length = len(index) - (1 if linear else 0)
+    tangents = y[:, 1:length+1] - y[:, :length]
+    origins = y[:, :length]
+    start = np.asarray(index)[:length]
+    j = np.arange(length)
+    result = np.zeros(len(y))
+    # Each unordered pair of segments is d apart in exactly one direction
+    # (the shorter, in a closed curve)
+    most = min(band, length) if linear else min(band, length // 2 + 1)
+    for d in range(1, most):
+        k = j - d
+        separation = start - start[k]
+        if linear:
+            near = (k >= 0) & (separation < band)
+        else:
+            separation %= num_points
+            near = np.minimum(separation, num_points - separation) < band
+            if 2*d == length:
+                # Opposite segments would otherwise be paired twice
+                near &= j < d
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block = kernel(_tiles(origins, j[near]),
+                           _tiles(tangents, j[near]),
+                           _tiles(origins, k[near]),
+                           _tiles(tangents, k[near]))
+        result += np.sum(np.nan_to_num(np.reshape(block, (len(y), -1))),
+                         axis=1, dtype=np.float64)
+    return result
+
+
+def adaptive_writhe(coords, kept, linear=False, method='gauss', theta=THETA):
+    """
+    Calculates writhe for each frame of an array of axis coordinates
+    of shape (num_steps, num_points, 3) from the points kept
+    (e.g. by decimate)
+    The contributions of nearby pairs of segments, which depend on
+    the fine structure of the curve, are those of the full curve;
+    only the smooth contributions of distant pairs come from the points kept
+    """
+    num_points = np.shape(coords)[1]
+    length = len(kept) - (1 if linear else 0)
+    sampled = close_curve(coords[:, kept], linear)
+    return (writhe_frames(sampled, length, method=method, theta=theta) -
+            near_writhe(sampled, kept, num_points, linear, method) +
+            near_writhe(close_curve(coords, linear), np.arange(num_points),
+                        num_points, linear, method))
+
+
+def _far_rows(origins, tangents, rows, moved, kernel, band=MAX_SPAN,
+              linear=False, block_size=BLOCK_SIZE):
+    """
+    Sums the contributions to writhe of the pairs of segments
+    at least band segments apart that involve the given rows,
+    counting each pair of rows (both of which are moved) once
+        origins & tangents have shape (length, 3)
+        moved is a boolean array marking the rows
+    """
+    length = len(origins)
+    k = np.arange(length)
+    total = 0.0
+    for start in range(0, len(rows), block_size):
+        j = rows[start:start+block_size]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block = kernel(origins[None, j], tangents[None, j],
+                           origins[None], tangents[None])[0]
+        separation = np.abs(j[:, None] - k[None, :])
+        if not linear:
+            separation = np.minimum(separation, length - separation)
+        keep = (separation >= band) & (~moved[k] | (k < j[:, None]))
+        total += np.sum(np.where(keep, np.nan_to_num(block), 0.0),
+                        dtype=np.float64)
+    return total
+
+
+def superimpose(points, target):
+    """
+    Returns points (of shape (num_points, 3)) rotated & translated
+    to best fit target in the least-squares sense (Kabsch W 1976
+    Acta Cryst A32 922-3), without reflection, so that writhe is unchanged
+    """
+    centre = np.mean(points, axis=0)
+    target_centre = np.mean(target, axis=0)
+    u, _, vt = np.linalg.svd(np.dot((points - centre).T,
+                                    target - target_centre))
+    # Exclude reflections
+    if np.linalg.det(np.dot(u, vt)) < 0:
+        u[:, -1] *= -1
+    return np.dot(points - centre, np.dot(u, vt)) + target_centre
+
+
+def incremental_writhe(y, length, linear=False, method='gauss',
+                       tolerance=0.1, refresh=REFRESH, band=MAX_SPAN):
+    """
+    Calculates writhe for a stack of consecutive timesteps,
+    as for writhe_frames, reusing the work done for the previous frame
+    The contributions of pairs of segments fewer than band segments apart
+    are recalculated every frame (see near_writhe);
+    those of more distant pairs are only recalculated for the segments
+    with a point that has moved by more than tolerance
+    since they were last calculated
+    (once the points used then are superimposed on the frame,
+    as writhe does not change under rotation or translation),
+    so the writhe of each frame is that of a curve
+    within tolerance of it
+    Everything is recalculated every refresh frames,
+    or once half of the segments have moved
+    """
+    kernel = METHODS.get(method)
+    if kernel is None:
+        raise ValueError(f"Incremental writhe needs a pairwise kernel; "
+                         f"expected one of {', '.join(METHODS)}")
+    y = floating(y)
+    num_points = len(y[0]) - (0 if linear else 1)
+    index = np.arange(num_points)
+    result = np.zeros(len(y))
+    for f, frame in enumerate(y):
+        near = near_writhe(frame[None], index, num_points, linear, method,
+                           band)[0]
+        if f % refresh == 0:
+            moved = None
+        else:
+            reference = superimpose(reference, frame[:num_points])
+            displaced = np.sqrt(np.sum((frame[:num_points] - reference)**2,
+                                       axis=1)) > tolerance
+            # Segments starting or ending at a displaced point
+            moved = displaced[:length] | np.roll(displaced, -1)[:length]
+        if moved is None or 2 * np.sum(moved) > length:
+            reference = np.array(frame[:num_points])
+            far = writhe_frames(frame[None], length, method=method)[0] - near
+        elif np.any(moved):
+            rows = np.nonzero(moved)[0]
+            curve = close_curve(reference[None], linear)[0]
+            far -= _far_rows(curve[:length], curve[1:] - curve[:-1], rows,
+                             moved, kernel, band, linear)
+            reference[displaced] = frame[:num_points][displaced]
+            curve = close_curve(reference[None], linear)[0]
+            far += _far_rows(curve[:length], curve[1:] - curve[:-1], rows,
+                             moved, kernel, band, linear)
+        result[f] = far + near
     return result
 
 
-def main(name, num_bp, num_steps, linear=False, write=True):
-    # Read file
-    coords = read_3col(name + '/C1.3col', num_bp, num_steps)
-    length = len(coords[0])
-    # Calculate writhe for num_steps timesteps
-    wr = []
-    for t in range(num_steps):
-        print(f"\r\tStep {t}...", end=" ")
-        wr.append([t+1, writhe(coords, t, length, linear)])
-    wr = np.array(wr)
+def calculate(coords, linear=False, method='gauss', stride=1, theta=THETA,
+              tolerance=0.0, incremental=0.0, refresh=REFRESH):
+    """
+    Calculates writhe for each frame of an array of axis coordinates
+    of shape (num_steps, num_bp, 3)
+        method is the name of the pairwise kernel (see METHODS);
+            'exact' remains accurate when the axis is coarse-grained;
+            'tree' scales as N log N, with accuracy set by theta
+        stride keeps only every stride-th point of the axis
+        tolerance, if non-zero, adaptively decimates the axis (see decimate),
+            dropping points within tolerance (Angstrom) of the curve kept
+        incremental, if non-zero, reuses the work done for each frame
+            for the next, recalculating only the pairs involving points
+            that have moved by more than incremental (Angstrom),
+            with everything recalculated every refresh frames
+            (see incremental_writhe), where refresh must be positive
+    theta must be at least 0 and less than 1 (see tree_writhe)
+    """
+    if refresh < 1:
+        raise ValueError(f"Writhe must be refreshed every positive number "
+                         f"of frames, not {refresh}")
+    if not 0 <= theta < 1:
+        raise ValueError(f"The opening angle must be at least 0 "
+                         f"and less than 1, not {theta}")
+    if stride > 1:
+        coords = coarse_grain(coords, stride, linear)
+    if incremental:
+        if tolerance:
+            raise ValueError("Incremental writhe cannot be combined "
+                             "with adaptive decimation")
+        length = len(coords[0]) - (1 if linear else 0)
+        return incremental_writhe(close_curve(coords, linear), length,
+                                  linear, method, incremental, refresh)
+    if tolerance:
+        return adaptive_writhe(coords, decimate(coords, tolerance, linear),
+                               linear, method, theta)
+    # An open curve has one fewer segment than it has points
+    length = len(coords[0]) - (1 if linear else 0)
+    return writhe_frames(close_curve(coords, linear), length,
+                         method=method, theta=theta)
+
+
+def density(coords, linear=False, method='gauss', stride=1, theta=THETA,
+            tolerance=0.0, incremental=0.0, refresh=REFRESH):
+    """
+    Calculates the contribution to writhe of the segment starting at each
+    point, for each frame of an array of axis coordinates
+    of shape (num_steps, num_points, 3), in a single pass
+    (see writhe_frames)
+    Returns an array of shape (num_steps, num_points) whose rows sum to
+    the writhe; the last point of an open curve starts no segment,
+    so contributes nothing
+    The full axis is needed for every frame,
+    so stride, tolerance & incremental cannot be used
+    """
+    if stride > 1 or tolerance or incremental:
+        raise ValueError("Writhe density needs the full axis, so cannot be "
+                         "combined with a stride, tolerance or incremental")
+    num_points = np.shape(coords)[1]
+    length = num_points - (1 if linear else 0)
+    result = np.zeros(np.shape(coords)[:2])
+    result[:, :length] = writhe_frames(close_curve(coords, linear), length,
+                                       method=method, theta=theta,
+                                       density=True)
+    return result
+
+
+def _window_sums(values, lo, hi, linear=False):
+    """
+    Sums values[:, i+lo:i+hi+1] about each point i of a curve,
+    wrapping around a closed curve and truncating at the ends of an open one
+    """
+    num_points = np.shape(values)[1]
+    pad = max(abs(lo), abs(hi))
+    if linear:
+        padded = np.pad(values, ((0, 0), (pad, pad)))
+    else:
+        padded = np.concatenate((values[:, -pad:], values, values[:, :pad]),
+                                axis=1)
+    cumulative = np.concatenate((np.zeros((len(values), 1)),
+                                 np.cumsum(padded, axis=1, dtype=np.float64)),
+                                axis=1)
+    i = np.arange(num_points) + pad
+    return cumulative[:, i + hi + 1] - cumulative[:, i + lo]
+
+
+def local_writhe(coords, linear=False, method='gauss', window=LOCAL_WINDOW):
+    """
+    Calculates the local writhe about each point for each frame
+    of an array of axis coordinates of shape (num_steps, num_points, 3):
+    the writhe of the pairs of segments that both start
+    within window // 2 points of it, so that plectonemes show up as peaks
+    Only pairs fewer than window segments apart are evaluated,
+    so the cost grows only linearly with the length of the curve
+    Returns an array of shape (num_steps, num_points)
+    """
+    kernel = METHODS.get(method, gauss_block)
+    curve = floating(close_curve(coords, linear))
+    num_frames, num_points = np.shape(coords)[:2]
+    length = num_points - (1 if linear else 0)
+    half = window // 2
+    if not linear and 4 * half >= length:
+        raise ValueError(f"A window of {window} points is too long "
+                         f"for a closed curve of {num_points} points")
+    tangents = curve[:, 1:length+1] - curve[:, :length]
+    origins = curve[:, :length]
+    result = np.zeros((num_frames, num_points))
+    for d in range(1, min(2 * half, length - 1) + 1):
+        # Pairs of segments j & j - d (which wraps around a closed curve)
+        j = np.arange(d if linear else 0, length)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block = kernel(_tiles(origins, j), _tiles(tangents, j),
+                           _tiles(origins, j - d), _tiles(tangents, j - d))
+        values = np.zeros((num_frames, num_points))
+        values[:, j] = np.nan_to_num(np.reshape(block, (num_frames, -1)))
+        # The pair lies in the window about point i
+        # if i - half <= j - d and j <= i + half
+        result += _window_sums(values, d - half, half, linear)
+    return result
+
+
+def error_estimate(coords, wr, linear=False, method='gauss', stride=1,
+                   theta=THETA, tolerance=0.0, incremental=0.0,
+                   refresh=REFRESH):
+    """
+    Estimates the error in the writhe wr of each frame
+    given by calculate with the same arguments,
+    as its difference from the writhe found (see adaptive_writhe)
+    with every other point kept by decimate dropped
+    Provided the error falls at least in proportion to the spacing
+    of the points, this bounds the error in wr
+    With no tolerance, no points are dropped, so the estimate is zero
+    """
+    if not tolerance:
+        return np.zeros(len(wr))
+    if stride > 1:
+        coords = coarse_grain(coords, stride, linear)
+    kept = decimate(coords, tolerance, linear)
+    coarse = kept[::2]
+    if linear and coarse[-1] != kept[-1]:
+        coarse = np.append(coarse, kept[-1])
+    return np.abs(adaptive_writhe(coords, coarse, linear, method, theta) - wr)
+
+
+def series(wr, first_step=0):
+    """
+    Labels each value of writhe (or row of values, e.g. from density)
+    with its (one-based) step number
+    """
+    steps = first_step + np.arange(1, len(wr) + 1)
+    return np.column_stack((steps, wr))
+
+
+def density_format(num_points):
+    """
+    Returns the format of each row of writhe_density.ser & local_writhe.ser
+    """
+    return FORMAT.split()[0] + (' ' + DENSITY_FORMAT) * num_points
+
+
+def main(name, num_bp, num_steps, linear=False, write=True, method='gauss',
+         stride=1, theta=THETA, tolerance=0.0, binary=None):
+    """
+    Calculates writhe for every timestep of the helical axis in name
+    See calculate for the meaning of method, stride, theta & tolerance,
+    and read_axis for binary
+    """
+    coords = read_axis(name, num_bp, num_steps, binary)
+    # Calculate writhe for all num_steps timesteps at once
+    wr = series(calculate(coords, linear, method, stride, theta, tolerance))
     if write:
-        np.savetxt(name+'/writhe.ser', wr, fmt='%5d %9.4f')
-    print("Done!")
+        np.savetxt(name+'/writhe.ser', wr, fmt=FORMAT)
     return wr